@@ -0,0 +1,111 @@
+"""
+Benchmark: event-loop latency and throughput of the 'thread' vs 'process' engine
+
+Runs concurrent probe jobs (_run_probe through VideoDownloader._run_in_engine)
+against a large local page, so yt-dlp extraction is CPU-bound, while a ticker
+task measures how late the event loop wakes up. High latency means the bot
+answers other users slowly while downloads are being prepared.
+
+Usage:
+    python benchmarks/bench_engine.py [--jobs 32] [--page-kb 2048]
+"""
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import DOWNLOAD_WORKERS, create_directories
+from bot.downloader import _run_probe, downloader
+from benchmarks.fixtures import FixtureServer
+
+TICK = 0.01
+
+
+def build_page(size: int) -> bytes:
+    """HTML page with a video tag after a lot of inline script (parsed by the generic extractor)"""
+    random.seed(0)
+    chunks, total = [], 0
+    while total < size:
+        words = ' '.join(''.join(random.choices(string.ascii_lowercase, k=8)) for _ in range(16))
+        chunk = f'<script>var data_{total} = {{"text": "{words}", "n": {total}}};</script>\n'
+        chunks.append(chunk)
+        total += len(chunk)
+    body = ''.join(chunks)
+    return (
+        '<!DOCTYPE html><html><head><title>Heavy page</title></head><body>'
+        f'{body}<video controls><source src="/clip.mp4" type="video/mp4"></video></body></html>'
+    ).encode()
+
+
+async def measure_lag(stop: asyncio.Event, lags: list):
+    """Overshoot of asyncio.sleep(TICK) - how long the loop was blocked"""
+    while not stop.is_set():
+        started_at = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - started_at - TICK)
+
+
+def percentile(values: list, fraction: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+async def run_engine(engine: str, url: str, jobs: int) -> dict:
+    downloader.engine = engine
+    # Прогрев: запуск процессов и импорт yt-dlp не входят в замер
+    await asyncio.gather(*(
+        downloader._run_in_engine(_run_probe, url, 'unknown', None) for _ in range(DOWNLOAD_WORKERS)
+    ))
+
+    stop, lags = asyncio.Event(), []
+    ticker = asyncio.ensure_future(measure_lag(stop, lags))
+    started_at = time.perf_counter()
+    results = await asyncio.gather(*(
+        downloader._run_in_engine(_run_probe, url, 'unknown', None) for _ in range(jobs)
+    ))
+    elapsed = time.perf_counter() - started_at
+    stop.set()
+    await ticker
+
+    failed = [r['error'] for r in results if not r['info']]
+    if failed:
+        raise RuntimeError(f"{engine}: {len(failed)} probes failed: {failed[0]}")
+    return {
+        'jobs_per_sec': jobs / elapsed,
+        'lag_p50': percentile(lags, 0.5) * 1000,
+        'lag_p99': percentile(lags, 0.99) * 1000,
+        'lag_max': max(lags) * 1000,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=32)
+    parser.add_argument('--page-kb', type=int, default=2048)
+    args = parser.parse_args()
+
+    create_directories()
+    with FixtureServer() as server:
+        server.add('/page.html', build_page(args.page_kb * 1024), 'text/html; charset=utf-8')
+        server.add('/clip.mp4', os.urandom(64 * 1024), 'video/mp4')
+        url = f"{server.url}/page.html"
+
+        results = {engine: asyncio.run(run_engine(engine, url, args.jobs)) for engine in ('thread', 'process')}
+        if downloader._process_pool:
+            downloader._process_pool.shutdown()
+
+    print(f"📊 {args.jobs} probes of a {args.page_kb}KB page, {DOWNLOAD_WORKERS} workers")
+    print(f"{'engine':>8} {'jobs/s':>8} {'lag p50':>9} {'lag p99':>9} {'lag max':>9}")
+    for engine, r in results.items():
+        print(f"{engine:>8} {r['jobs_per_sec']:>8.2f} {r['lag_p50']:>7.1f}ms "
+              f"{r['lag_p99']:>7.1f}ms {r['lag_max']:>7.1f}ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
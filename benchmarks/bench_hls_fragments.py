@@ -0,0 +1,106 @@
+"""
+Benchmark: concurrent HLS fragment downloads against a local fixture server
+
+Serves an HLS media playlist whose segments answer with an artificial latency
+(a distant CDN) and downloads it through the bot's own probe/download path
+(_run_probe, _run_download) with different concurrent_fragment_downloads values.
+Also checks that the size guard fires while fragments download concurrently.
+
+Usage:
+    python benchmarks/bench_hls_fragments.py [--segments 40] [--segment-kb 256] [--latency 0.05]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import FRAGMENT_DOWNLOAD_SETTINGS, create_directories
+from bot.downloader import _progress_sinks, _run_download, _run_probe
+from benchmarks.fixtures import FixtureServer
+
+
+def build_playlist(server: FixtureServer, segments: int, segment_size: int) -> str:
+    """Register playlist and segments, return playlist URL"""
+    lines = ['#EXTM3U', '#EXT-X-VERSION:3', '#EXT-X-TARGETDURATION:2', '#EXT-X-MEDIA-SEQUENCE:0']
+    for index in range(segments):
+        server.add(f"/seg{index}.ts", os.urandom(segment_size), 'video/mp2t')
+        lines += ['#EXTINF:2.0,', f"seg{index}.ts"]
+    lines.append('#EXT-X-ENDLIST')
+    server.add('/stream.m3u8', '\n'.join(lines).encode(), 'application/vnd.apple.mpegurl')
+    return f"{server.url}/stream.m3u8"
+
+
+def download(info: dict, concurrency: int, max_size: int, workdir: str) -> dict:
+    """One download through _run_download; returns result with timing"""
+    job_id = uuid.uuid4().hex
+    events = []
+    _progress_sinks[job_id] = events.append
+    outtmpl = os.path.join(workdir, f"hls_{concurrency}_{job_id}.mp4")
+    job_opts = {
+        'concurrent_fragment_downloads': concurrency,
+        'format': info.get('format_id') or 'best',
+        'outtmpl': outtmpl,
+        'continuedl': False,
+        # Сегменты - случайные байты, ffmpeg fixup тут не нужен
+        'fixup': 'never',
+    }
+    started_at = time.perf_counter()
+    try:
+        result = _run_download(job_id, 'unknown', None, info, job_opts, max_size)
+    finally:
+        _progress_sinks.pop(job_id, None)
+    result['seconds'] = time.perf_counter() - started_at
+    result['size'] = os.path.getsize(outtmpl) if os.path.exists(outtmpl) else 0
+    result['events'] = len(events)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--segments', type=int, default=40)
+    parser.add_argument('--segment-kb', type=int, default=256)
+    parser.add_argument('--latency', type=float, default=0.05, help='seconds per request')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 2, 4, 8])
+    args = parser.parse_args()
+
+    create_directories()
+    segment_size = args.segment_kb * 1024
+    total = args.segments * segment_size
+
+    with FixtureServer(latency=args.latency) as server, tempfile.TemporaryDirectory() as workdir:
+        url = build_playlist(server, args.segments, segment_size)
+        probe = _run_probe(url, 'unknown', None)
+        if not probe['info']:
+            print(f"❌ Probe failed: {probe['error']}")
+            return 1
+
+        print(f"📼 {args.segments} segments x {args.segment_kb}KB, {args.latency * 1000:.0f} ms per request")
+        print(f"⚙️ FRAGMENT_DOWNLOAD_SETTINGS: {FRAGMENT_DOWNLOAD_SETTINGS}")
+        print(f"{'fragments':>10} {'seconds':>9} {'MB/s':>8} {'speedup':>8}")
+        baseline = None
+        for concurrency in args.concurrency:
+            result = download(probe['info'], concurrency, total * 2, workdir)
+            if result['error'] or result['size'] != total:
+                print(f"❌ {concurrency} fragments: {result['error'] or 'size ' + str(result['size'])}")
+                return 1
+            baseline = baseline or result['seconds']
+            print(f"{concurrency:>10} {result['seconds']:>9.2f} "
+                  f"{total / result['seconds'] / 1024 / 1024:>8.2f} {baseline / result['seconds']:>7.1f}x")
+
+        # Хук прогресса должен срабатывать и в потоках фрагментов yt-dlp
+        concurrency = max(args.concurrency)
+        result = download(probe['info'], concurrency, total // 2, workdir)
+        if result['size_exceeded']:
+            print(f"✅ Size guard stopped the download at {concurrency} fragments")
+        else:
+            print(f"❌ Size guard did not fire at {concurrency} fragments: {result['error']}")
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
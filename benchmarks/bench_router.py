@@ -0,0 +1,144 @@
+"""
+Micro-benchmark: URL router (route_url) over a corpus of real-world URL shapes
+
+Checks canonical ids for a table of known shapes (including spoofed hosts and
+short links), then times route_url() against the substring checks it replaced.
+
+Usage:
+    python benchmarks/bench_router.py [--size 100000] [--repeat 5]
+"""
+import argparse
+import os
+import random
+import string
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import ALLOWED_DOMAINS
+from bot.utils import is_short_link, route_url
+
+# (url, platform | None, canonical_id | None, short link)
+KNOWN_SHAPES = [
+    ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://m.youtube.com/watch?feature=share&v=dQw4w9WgXcQ&t=42', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://music.youtube.com/watch?v=dQw4w9WgXcQ&list=RD', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://youtu.be/dQw4w9WgXcQ?si=abc', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://www.youtube.com/shorts/dQw4w9WgXcQ', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://www.youtube.com/embed/dQw4w9WgXcQ', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://www.youtube.com/live/dQw4w9WgXcQ?feature=share', 'youtube', 'youtube:dQw4w9WgXcQ', False),
+    ('https://www.youtube.com/@channel/videos', 'youtube', None, False),
+    ('https://www.instagram.com/reel/C1a2B3c4D5e/', 'instagram', 'instagram:C1a2B3c4D5e', False),
+    ('https://www.instagram.com/reels/C1a2B3c4D5e/?igsh=x', 'instagram', 'instagram:C1a2B3c4D5e', False),
+    ('https://instagram.com/p/C1a2B3c4D5e', 'instagram', 'instagram:C1a2B3c4D5e', False),
+    ('https://www.instagram.com/tv/C1a2B3c4D5e/', 'instagram', 'instagram:C1a2B3c4D5e', False),
+    ('https://www.instagram.com/some.user/reel/C1a2B3c4D5e/', 'instagram', 'instagram:C1a2B3c4D5e', False),
+    ('https://www.instagram.com/share/reel/BAdEf123/', 'instagram', None, True),
+    ('https://www.tiktok.com/@user.name/video/7234567890123456789', 'tiktok', 'tiktok:7234567890123456789', False),
+    ('https://m.tiktok.com/v/7234567890123456789.html', 'tiktok', 'tiktok:7234567890123456789', False),
+    ('https://www.tiktok.com/embed/v2/7234567890123456789', 'tiktok', 'tiktok:7234567890123456789', False),
+    ('https://vm.tiktok.com/ZMabc123/', 'tiktok', None, True),
+    ('https://vt.tiktok.com/ZSabc123/', 'tiktok', None, True),
+    ('https://www.tiktok.com/t/ZTabc123/', 'tiktok', None, True),
+    # Подделки и чужие хосты
+    ('https://evil.com/?instagram.com', None, None, False),
+    ('https://instagram.com.evil.com/reel/C1a2B3c4D5e/', None, None, False),
+    ('https://notyoutube.com/watch?v=dQw4w9WgXcQ', None, None, False),
+    ('https://evil.com/youtu.be/dQw4w9WgXcQ', None, None, False),
+    ('javascript://youtube.com/%0aalert(1)', None, None, False),
+    ('https://vimeo.com/123456', None, None, False),
+]
+
+
+def legacy_check(url: str):
+    """Substring checks used before the router (domain validation + platform detection)"""
+    url_lower = url.lower()
+    if not any(domain in url_lower for domain in ALLOWED_DOMAINS):
+        return None
+    if 'instagram.com' in url_lower:
+        return 'instagram'
+    elif 'tiktok.com' in url_lower or 'vt.tiktok.com' in url_lower:
+        return 'tiktok'
+    elif 'youtube.com' in url_lower or 'youtu.be' in url_lower:
+        return 'youtube'
+    return 'unknown'
+
+
+def _token(length: int, alphabet: str = string.ascii_letters + string.digits + '-_') -> str:
+    return ''.join(random.choices(alphabet, k=length))
+
+
+def build_corpus(size: int) -> list:
+    """Random URLs of every supported shape plus spoofed and foreign hosts"""
+    shapes = [
+        lambda: f"https://www.youtube.com/watch?v={_token(11)}",
+        lambda: f"https://m.youtube.com/watch?app=desktop&v={_token(11)}&t={random.randint(1, 900)}s",
+        lambda: f"https://youtu.be/{_token(11)}?si={_token(16)}",
+        lambda: f"https://www.youtube.com/shorts/{_token(11)}",
+        lambda: f"https://www.instagram.com/reel/{_token(11)}/?igsh={_token(20)}",
+        lambda: f"https://www.instagram.com/p/{_token(11)}/",
+        lambda: f"https://www.instagram.com/{_token(8, string.ascii_lowercase)}/reel/{_token(11)}/",
+        lambda: f"https://www.instagram.com/share/reel/{_token(10)}/",
+        lambda: f"https://www.tiktok.com/@{_token(8, string.ascii_lowercase)}/video/{random.randint(10**18, 10**19)}",
+        lambda: f"https://vm.tiktok.com/{_token(9)}/",
+        lambda: f"https://www.tiktok.com/t/{_token(9)}/",
+        lambda: f"https://evil.com/?u=instagram.com/reel/{_token(11)}",
+        lambda: f"https://instagram.com.{_token(6, string.ascii_lowercase)}.net/p/{_token(11)}/",
+        lambda: f"https://vimeo.com/{random.randint(10**6, 10**9)}",
+    ]
+    return [random.choice(shapes)() for _ in range(size)]
+
+
+def check_known_shapes() -> int:
+    """Number of mismatches in KNOWN_SHAPES"""
+    failures = 0
+    for url, platform, canonical_id, short in KNOWN_SHAPES:
+        route = route_url(url)
+        got = (route.platform, route.canonical_id) if route else (None, None)
+        got_short = is_short_link(url)
+        if got != (platform, canonical_id) or got_short != short:
+            failures += 1
+            print(f"❌ {url}: {got}, short={got_short}; expected {(platform, canonical_id)}, short={short}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--size', type=int, default=100000, help='corpus size')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    failures = check_known_shapes()
+    if failures:
+        return 1
+    print(f"✅ {len(KNOWN_SHAPES)} known URL shapes routed correctly")
+
+    random.seed(0)
+    corpus = build_corpus(args.size)
+
+    def run(func):
+        best = min(timeit.repeat(lambda: [func(url) for url in corpus], number=1, repeat=args.repeat))
+        return best / len(corpus) * 1e6
+
+    router_us = run(route_url)
+    legacy_us = run(legacy_check)
+    short_us = run(is_short_link)
+
+    routed = [route_url(url) for url in corpus]
+    with_id = sum(1 for route in routed if route and route.canonical_id)
+    rejected = sum(1 for route in routed if route is None)
+    legacy_accepted_spoofs = sum(
+        1 for url, route in zip(corpus, routed) if route is None and legacy_check(url) is not None
+    )
+
+    print(f"📊 {len(corpus)} URLs: {with_id} with canonical id, {rejected} rejected")
+    print(f"⏱️ route_url:     {router_us:.2f} µs/URL")
+    print(f"⏱️ is_short_link: {short_us:.2f} µs/URL")
+    print(f"⏱️ legacy checks: {legacy_us:.2f} µs/URL (no canonical id, "
+          f"accepted {legacy_accepted_spoofs} URLs the router rejects)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,80 @@
+"""
+Benchmark: per-job overhead of a fresh YoutubeDL versus a warm pooled instance
+
+Every job extracts a small page from a local fixture server. "fresh" builds
+yt_dlp.YoutubeDL(opts) per job (the code before YoutubeDLPool); "pooled" takes
+the warm instance of the thread via downloader.ydl_pool.job(). Reports time
+per job and TCP connections opened, i.e. whether keep-alive connections are
+reused across jobs.
+
+Usage:
+    python benchmarks/bench_ydl_pool.py [--jobs 100]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yt_dlp
+
+from bot.downloader import downloader
+from benchmarks.fixtures import FixtureServer
+
+PAGE = b"""<!DOCTYPE html>
+<html><head><title>Fixture clip</title></head>
+<body><video controls><source src="/clip.mp4" type="video/mp4"></video></body></html>
+"""
+
+
+def fresh_job(url: str) -> dict:
+    """Before: new YoutubeDL per job, closed afterwards"""
+    with yt_dlp.YoutubeDL(dict(downloader.ydl_pool.base_opts)) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def pooled_job(url: str) -> dict:
+    """After: warm instance of this thread with per-job options applied"""
+    with downloader.ydl_pool.job('unknown', None, {'format': 'best'}) as ydl:
+        return ydl.extract_info(url, download=False)
+
+
+def measure(server: FixtureServer, func, url: str, jobs: int) -> tuple:
+    server.reset_counters()
+    started_at = time.perf_counter()
+    for _ in range(jobs):
+        info = func(url)
+        if not info or not info.get('url'):
+            raise RuntimeError(f"{func.__name__}: no media URL extracted")
+    per_job_ms = (time.perf_counter() - started_at) / jobs * 1000
+    return per_job_ms, server.connections
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--jobs', type=int, default=100)
+    args = parser.parse_args()
+
+    with FixtureServer() as server:
+        server.add('/page.html', PAGE, 'text/html; charset=utf-8')
+        server.add('/clip.mp4', os.urandom(64 * 1024), 'video/mp4')
+        url = f"{server.url}/page.html"
+
+        # Импорт экстракторов и первый экземпляр пула не входят в замер
+        fresh_job(url)
+        pooled_job(url)
+
+        fresh_ms, fresh_connections = measure(server, fresh_job, url, args.jobs)
+        pooled_ms, pooled_connections = measure(server, pooled_job, url, args.jobs)
+
+    print(f"📊 {args.jobs} extraction jobs against a local page")
+    print(f"⏱️ fresh YoutubeDL:  {fresh_ms:7.2f} ms/job, {fresh_connections} connections")
+    print(f"⏱️ pooled instance:  {pooled_ms:7.2f} ms/job, {pooled_connections} connections")
+    print(f"🚀 Speedup: {fresh_ms / pooled_ms:.1f}x, instances created: {downloader.ydl_pool.created}, "
+          f"reused: {downloader.ydl_pool.reused}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,100 @@
+"""
+Check: self-hosted Bot API mode against a local stand-in server
+
+Points TELEGRAM_API_URL at a local server that records requests and answers
+like the Bot API, builds the bot with main.build_application() and sends a
+video the way handlers do. In local mode the request must carry a file://
+path instead of the video bytes, and the chat size limit must be 2000MB.
+
+Usage:
+    python benchmarks/check_local_bot_api.py
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+from pathlib import Path
+from urllib.parse import unquote_to_bytes
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.fixtures import FixtureServer
+
+TOKEN = '123456:TEST-TOKEN'
+VIDEO_SIZE = 512 * 1024
+
+
+def api_response(result: dict):
+    return 200, {'Content-Type': 'application/json'}, json.dumps({'ok': True, 'result': result}).encode()
+
+
+def register_routes(server: FixtureServer):
+    server.routes[f"/bot{TOKEN}/getMe"] = api_response({
+        'id': 123456, 'is_bot': True, 'first_name': 'Stand-in', 'username': 'standin_bot',
+    })
+    server.routes[f"/bot{TOKEN}/sendVideo"] = api_response({
+        'message_id': 1, 'date': 0, 'chat': {'id': 42, 'type': 'private'},
+        'video': {'file_id': 'FILE_ID', 'file_unique_id': 'UNIQUE', 'width': 1, 'height': 1,
+                  'duration': 1, 'file_size': VIDEO_SIZE},
+    })
+
+
+def last_request(server: FixtureServer, method: str) -> tuple:
+    return next(r for r in reversed(server.requests) if r[1].endswith(f"/{method}"))
+
+
+async def run_checks(server: FixtureServer, video_path: Path) -> int:
+    # Конфигурация читается при импорте - окружение задаем до него
+    os.environ.update({
+        'TELEGRAM_TOKEN': TOKEN, 'TELEGRAM_API_URL': server.url, 'TELEGRAM_LOCAL_MODE': '1',
+    })
+    import config
+    from main import build_application
+
+    failures = 0
+
+    def check(ok: bool, message: str):
+        nonlocal failures
+        print(f"{'✅' if ok else '❌'} {message}")
+        failures += not ok
+
+    check(config.DEFAULT_MAX_CHAT_SIZE == 2000 * 1024 * 1024,
+          f"Chat size limit in local mode: {config.DEFAULT_MAX_CHAT_SIZE // (1024 * 1024)}MB")
+
+    application = build_application()
+    bot = application.bot
+    await bot.initialize()
+    try:
+        check(any(r[1] == f"/bot{TOKEN}/getMe" for r in server.requests),
+              f"getMe went to the stand-in server ({server.url})")
+
+        # Как handlers.py в локальном режиме: путь к файлу вместо потока байт
+        message = await bot.send_video(chat_id=42, video=video_path, supports_streaming=True)
+        _, _, headers, body = last_request(server, 'sendVideo')
+        check(video_path.resolve().as_uri().encode() in unquote_to_bytes(body) and len(body) < VIDEO_SIZE,
+              f"Path send: {len(body)} bytes on the wire, file:// URI instead of the video")
+        check(message.video.file_id == 'FILE_ID', "Response parsed into a Message with a video")
+
+        # Для сравнения: файловый объект загружается целиком (обычный режим)
+        with open(video_path, 'rb') as video_file:
+            await bot.send_video(chat_id=42, video=video_file, supports_streaming=True)
+        _, _, headers, body = last_request(server, 'sendVideo')
+        check(len(body) >= VIDEO_SIZE and 'multipart/form-data' in headers.get('Content-Type', ''),
+              f"Stream send: {len(body)} bytes on the wire (multipart upload)")
+    finally:
+        await bot.shutdown()
+    return failures
+
+
+def main():
+    with FixtureServer() as server, tempfile.TemporaryDirectory() as workdir:
+        register_routes(server)
+        video_path = Path(workdir) / 'video.mp4'
+        video_path.write_bytes(os.urandom(VIDEO_SIZE))
+        failures = asyncio.run(run_checks(server, video_path))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+"""
+Check: short-link resolver against a local redirect stand-in server
+
+TikTok and Instagram short-link hosts are pointed at a local server that
+answers with redirect chains. Checks canonical URLs, fallbacks for dead links,
+the LRU cache and keep-alive connection reuse of the shared aiohttp pool.
+
+Usage:
+    python benchmarks/check_short_links.py
+"""
+import asyncio
+import os
+import socket
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import aiohttp
+from aiohttp.abc import AbstractResolver
+
+from bot.short_links import ShortLinkResolver
+from benchmarks.fixtures import FixtureServer
+
+
+class LocalResolver(AbstractResolver):
+    """DNS stand-in: every host resolves to 127.0.0.1"""
+
+    async def resolve(self, host, port=0, family=socket.AF_INET):
+        return [{
+            'hostname': host, 'host': '127.0.0.1', 'port': port,
+            'family': socket.AF_INET, 'proto': 0, 'flags': socket.AI_NUMERICHOST,
+        }]
+
+    async def close(self):
+        pass
+
+
+def register_routes(server: FixtureServer):
+    video = 'https://www.tiktok.com/@user.name/video/7234567890123456789'
+    server.redirect('/ZMabc123/', f"{video}?_r=1&u_code=x", 301)
+    # Две ступени: относительный редирект, затем ссылка на видео
+    server.redirect('/t/ZTabc123/', '/link/v2/ZTabc123', 302)
+    server.redirect('/link/v2/ZTabc123', video, 302)
+    server.redirect('/share/reel/BAdEf123/', 'https://www.instagram.com/reel/C1a2B3c4D5e/?igsh=abc', 302)
+    # Редирект на чужой сайт и мертвая ссылка - остаются как есть
+    server.redirect('/ZMforeign/', 'https://example.com/landing', 302)
+
+
+async def run_checks(server: FixtureServer) -> int:
+    port = server.port
+    cases = [
+        (f"http://vm.tiktok.com:{port}/ZMabc123/",
+         'https://www.tiktok.com/@user.name/video/7234567890123456789'),
+        (f"http://www.tiktok.com:{port}/t/ZTabc123/",
+         'https://www.tiktok.com/@user.name/video/7234567890123456789'),
+        (f"http://www.instagram.com:{port}/share/reel/BAdEf123/",
+         'https://www.instagram.com/reel/C1a2B3c4D5e/'),
+        (f"http://vm.tiktok.com:{port}/ZMforeign/", None),
+        (f"http://vt.tiktok.com:{port}/ZSdead000/", None),
+        # Не короткая ссылка - сеть не нужна
+        ('https://www.youtube.com/watch?v=dQw4w9WgXcQ', None),
+    ]
+
+    resolver = ShortLinkResolver()
+    # Тот же пул, что создает _get_session(), но DNS ведет на локальный сервер
+    resolver._session = aiohttp.ClientSession(
+        connector=aiohttp.TCPConnector(limit=20, resolver=LocalResolver(), keepalive_timeout=60),
+        timeout=aiohttp.ClientTimeout(total=5),
+    )
+
+    failures = 0
+    try:
+        for url, expected in cases:
+            resolved = await resolver.resolve(url)
+            expected = expected or url
+            if resolved != expected:
+                failures += 1
+                print(f"❌ {url} -> {resolved}, expected {expected}")
+            else:
+                print(f"✅ {url} -> {resolved}")
+
+        cold_requests, connections = len(server.requests), server.connections
+        for url, _ in cases[:3]:
+            await resolver.resolve(url)
+        if len(server.requests) != cold_requests or resolver.hits != 3:
+            failures += 1
+            print(f"❌ Cache: {resolver.hits} hits, {len(server.requests) - cold_requests} extra requests")
+        else:
+            print(f"✅ Cache: repeated links resolved without requests ({resolver.hits} hits)")
+
+        # Соединения держатся по одному на хост, а не на каждый редирект
+        hosts = {url.split('/')[2] for url, _ in cases[:-1]}
+        if connections > len(hosts):
+            failures += 1
+            print(f"❌ Keep-alive: {connections} connections for {cold_requests} requests to {len(hosts)} hosts")
+        else:
+            print(f"✅ Keep-alive: {connections} connections for {cold_requests} requests to {len(hosts)} hosts")
+    finally:
+        await resolver.close()
+    return failures
+
+
+def main():
+    with FixtureServer() as server:
+        register_routes(server)
+        failures = asyncio.run(run_checks(server))
+    return 1 if failures else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
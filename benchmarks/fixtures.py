@@ -0,0 +1,116 @@
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Callable, Dict, Optional, Tuple, Union
+
+# Ответ маршрута: (код, заголовки, тело) или функция, которая его строит
+Response = Tuple[int, Dict[str, str], bytes]
+Route = Union[Response, Callable[[BaseHTTPRequestHandler], Response]]
+
+
+class _QuietHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Клиенты (yt-dlp, aiohttp) закрывают keep-alive соединения без предупреждения
+        if not isinstance(sys.exc_info()[1], (ConnectionResetError, BrokenPipeError)):
+            super().handle_error(request, client_address)
+
+
+class FixtureServer:
+    """
+    Local HTTP/1.1 server for benchmarks and stand-in checks
+
+    Serves registered routes with an optional per-request latency (simulates
+    a distant CDN) and counts TCP connections and requests, so connection
+    reuse is visible. Runs in a daemon thread: use as a context manager.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.routes: Dict[str, Route] = {}
+        self.connections = 0
+        self.requests = []  # (method, path, headers, body)
+        self._lock = threading.Lock()
+        self._httpd: Optional[_QuietHTTPServer] = None
+
+    @property
+    def url(self) -> str:
+        host, port = self._httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    def add(self, path: str, body: bytes, content_type: str = 'application/octet-stream'):
+        """Static route"""
+        self.routes[path] = (200, {'Content-Type': content_type}, body)
+
+    def redirect(self, path: str, location: str, status: int = 302):
+        """Redirect route"""
+        self.routes[path] = (status, {'Location': location}, b'')
+
+    def reset_counters(self):
+        with self._lock:
+            self.connections = 0
+            self.requests.clear()
+
+    def _make_handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def setup(self):
+                super().setup()
+                with server._lock:
+                    server.connections += 1
+
+            def log_message(self, *args):
+                pass
+
+            def _respond(self, send_body: bool):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = self.rfile.read(length) if length else b''
+                with server._lock:
+                    server.requests.append((self.command, self.path, dict(self.headers), body))
+
+                route = server.routes.get(self.path.split('?')[0])
+                if route is None:
+                    status, headers, payload = 404, {'Content-Type': 'text/plain'}, b'not found'
+                elif callable(route):
+                    status, headers, payload = route(self)
+                else:
+                    status, headers, payload = route
+
+                if server.latency:
+                    time.sleep(server.latency)
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                if send_body:
+                    self.wfile.write(payload)
+
+            def do_GET(self):
+                self._respond(True)
+
+            def do_POST(self):
+                self._respond(True)
+
+            def do_HEAD(self):
+                self._respond(False)
+
+        return Handler
+
+    def __enter__(self) -> 'FixtureServer':
+        self._httpd = _QuietHTTPServer(('127.0.0.1', 0), self._make_handler())
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc):
+        self._httpd.shutdown()
+        self._httpd.server_close()
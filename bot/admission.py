@@ -0,0 +1,93 @@
+import time
+from typing import Dict, List, Optional
+
+from config import ADMIN_IDS, USER_MAX_INFLIGHT, USER_RATE_PER_MINUTE, USER_RATE_BURST
+
+
+class _TokenBucket:
+    """Token bucket: capacity tokens, refilled at rate tokens per second"""
+
+    def __init__(self, capacity: float, rate: float):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def try_take(self) -> bool:
+        self._refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    def wait_seconds(self) -> float:
+        """Time until the next token"""
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+
+class AdmissionControl:
+    """Per-user request rate and in-flight limits, checked before any download work"""
+
+    def __init__(self, max_inflight: int, rate_per_minute: float, burst: int, exempt_ids: List[int]):
+        self.max_inflight = max_inflight
+        self.rate_per_minute = rate_per_minute
+        self.burst = burst
+        self.exempt_ids = exempt_ids
+        self._buckets: Dict[int, _TokenBucket] = {}
+        self._inflight: Dict[int, int] = {}
+        self.stats = {
+            'admitted': 0,
+            'rejected_inflight': 0,  # Превышен лимит одновременных ссылок
+            'rejected_rate': 0,  # Превышена частота запросов
+        }
+
+    def try_acquire(self, user_id: int) -> Optional[str]:
+        """
+        Admit one request of user
+
+        Returns None if admitted (release() must follow), otherwise the rejection reason.
+        """
+        if user_id not in self.exempt_ids:
+            if self._inflight.get(user_id, 0) >= self.max_inflight:
+                self.stats['rejected_inflight'] += 1
+                return (
+                    f"Слишком много ссылок одновременно (лимит {self.max_inflight}). "
+                    "Дождитесь завершения текущих загрузок."
+                )
+
+            bucket = self._buckets.get(user_id)
+            if bucket is None:
+                bucket = self._buckets[user_id] = _TokenBucket(self.burst, self.rate_per_minute / 60)
+            if not bucket.try_take():
+                self.stats['rejected_rate'] += 1
+                return f"Слишком много запросов. Попробуйте через {bucket.wait_seconds():.0f} с."
+
+        self._inflight[user_id] = self._inflight.get(user_id, 0) + 1
+        self.stats['admitted'] += 1
+        return None
+
+    def release(self, user_id: int):
+        """Request of user finished"""
+        count = self._inflight.get(user_id, 0) - 1
+        if count > 0:
+            self._inflight[user_id] = count
+        else:
+            self._inflight.pop(user_id, None)
+            # Полное ведро ничем не отличается от отсутствующего
+            bucket = self._buckets.get(user_id)
+            if bucket and bucket.wait_seconds() == 0 and bucket.tokens >= bucket.capacity:
+                del self._buckets[user_id]
+
+    def inflight(self) -> Dict[int, int]:
+        """Requests in progress by user"""
+        return dict(self._inflight)
+
+
+# Singleton instance
+admission = AdmissionControl(USER_MAX_INFLIGHT, USER_RATE_PER_MINUTE, USER_RATE_BURST, ADMIN_IDS)
@@ -0,0 +1,135 @@
+import threading
+import time
+from http.cookiejar import MozillaCookieJar
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from config import (
+    USE_BROWSER_COOKIES, COOKIES_FILE, COOKIES_DIR, COOKIES_CACHE_DIR, BROWSER_COOKIES_RETRY_MINUTES
+)
+
+
+class CookieProvider:
+    """
+    Per-platform cookies for yt-dlp, loaded lazily on first use
+
+    Sources in order: COOKIES_DIR/<platform>.txt, COOKIES_DIR/cookies.txt, COOKIES_FILE,
+    then the local browsers (if USE_BROWSER_COOKIES). Files are parsed once and
+    re-read when their mtime changes. Failures are logged, never raised.
+    """
+
+    PLATFORM_DOMAINS = {
+        'instagram': 'instagram.com',
+        'tiktok': 'tiktok.com',
+        'youtube': 'youtube.com',
+    }
+
+    def __init__(self):
+        self._jars: Dict[str, dict] = {}  # platform -> {'path', 'mtime'}
+        self._browser_failed_at: Dict[str, float] = {}
+        # Отдельная блокировка на платформу: медленный экспорт из браузера
+        # для одной платформы не задерживает остальные
+        self._locks = {platform: threading.Lock() for platform in self.PLATFORM_DOMAINS}
+
+    def _file_sources(self, platform: str) -> List[Path]:
+        """Candidate Netscape cookie files for platform"""
+        sources = []
+        if COOKIES_DIR:
+            sources += [COOKIES_DIR / f"{platform}.txt", COOKIES_DIR / "cookies.txt"]
+        if COOKIES_FILE:
+            sources.append(Path(COOKIES_FILE))
+        return sources
+
+    def get_cookiefile(self, platform: str) -> Optional[str]:
+        """Path to a Netscape cookie file for platform, or None (may block on first call)"""
+        if platform not in self.PLATFORM_DOMAINS:
+            return None
+
+        with self._locks[platform]:
+            for path in self._file_sources(platform):
+                if path.exists():
+                    entry = self._load_file(platform, path)
+                    if entry:
+                        return entry['path']
+
+            if USE_BROWSER_COOKIES:
+                return self._load_from_browser(platform)
+        return None
+
+    def cached_cookiefile(self, platform: str) -> Optional[str]:
+        """Path of the already loaded cookie file for platform (no I/O)"""
+        entry = self._jars.get(platform)
+        return entry['path'] if entry else None
+
+    def _load_file(self, platform: str, path: Path) -> Optional[dict]:
+        """Parse cookie file, reusing the cached jar while mtime is unchanged"""
+        try:
+            mtime = path.stat().st_mtime
+            entry = self._jars.get(platform)
+            if entry and entry['path'] == str(path) and entry['mtime'] == mtime:
+                return entry
+
+            jar = MozillaCookieJar(str(path))
+            jar.load(ignore_discard=True, ignore_expires=True)
+        except Exception as e:
+            print(f"⚠️ Error loading cookies from {path}: {e}")
+            return None
+
+        domain = self.PLATFORM_DOMAINS[platform]
+        count = sum(1 for cookie in jar if cookie.domain.lstrip('.').endswith(domain))
+        print(f"✅ Cookies for {platform} loaded from {path} ({count} cookies)")
+
+        entry = {'path': str(path), 'mtime': mtime}
+        self._jars[platform] = entry
+        return entry
+
+    def _load_from_browser(self, platform: str) -> Optional[str]:
+        """Export platform cookies from a local browser into a Netscape file"""
+        entry = self._jars.get(platform)
+        if entry and entry.get('browser'):
+            return entry['path']
+
+        failed_at = self._browser_failed_at.get(platform)
+        if failed_at and time.time() - failed_at < BROWSER_COOKIES_RETRY_MINUTES * 60:
+            return None
+
+        domain = self.PLATFORM_DOMAINS[platform]
+        try:
+            import browser_cookie3
+        except ImportError:
+            print("⚠️ browser-cookie3 not installed, skipping browser cookies")
+            self._browser_failed_at[platform] = time.time()
+            return None
+
+        for browser in [browser_cookie3.chrome, browser_cookie3.firefox,
+                        browser_cookie3.edge, browser_cookie3.opera]:
+            try:
+                cookies = browser(domain_name=domain)
+            except Exception:
+                continue
+            if not cookies or not len(cookies):
+                continue
+
+            try:
+                COOKIES_CACHE_DIR.mkdir(parents=True, exist_ok=True)
+                path = COOKIES_CACHE_DIR / f"browser_{platform}.txt"
+                jar = MozillaCookieJar(str(path))
+                for cookie in cookies:
+                    jar.set_cookie(cookie)
+                jar.save(ignore_discard=True, ignore_expires=True)
+            except Exception as e:
+                print(f"⚠️ Error saving browser cookies for {platform}: {e}")
+                break
+
+            print(f"✅ Cookies for {platform} loaded from {browser.__name__}")
+            self._jars[platform] = {
+                'path': str(path), 'mtime': path.stat().st_mtime, 'browser': True
+            }
+            return str(path)
+
+        self._browser_failed_at[platform] = time.time()
+        return None
+
+
+# Singleton instance
+cookie_provider = CookieProvider()
@@ -1,38 +1,485 @@
 import asyncio
+import copy
+import errno
+import hashlib
+import json
 import os
 import random
+import re
+import shutil
 import string
 import time
 import subprocess
+import threading
+import multiprocessing
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Optional, Tuple
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse, urlsplit
 
-import yt_dlp
-from config import USE_BROWSER_COOKIES, COOKIES_FILE, VIDEOS_DIR, TEMP_DOWNLOADS_DIR
+from config import (
+    VIDEOS_DIR, TEMP_DOWNLOADS_DIR, INCOMING_DIR, DEFAULT_MAX_CHAT_SIZE,
+    DOWNLOAD_WORKERS, DOWNLOAD_QUEUE_SIZE, PLATFORM_DOWNLOAD_LIMITS, PROGRESS_UPDATE_INTERVAL, DOWNLOAD_ENGINE,
+    PLAYLIST_DOWNLOAD_CONCURRENCY, ADMIN_IDS, ADMIN_SCHEDULER_WEIGHT,
+    FRAGMENT_DOWNLOAD_SETTINGS, PARTIAL_DOWNLOAD_MAX_AGE_HOURS,
+    RAM_STAGING_DIR, RAM_STAGING_MAX_FILE_SIZE, RAM_STAGING_BUDGET,
+    DIRECT_URL_DELIVERY, DIRECT_URL_MAX_SIZE,
+    METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES, METADATA_CACHE_DISK, METADATA_CACHE_DIR
+)
+from bot.scheduler import DownloadScheduler, QueueFullError
+from bot.format_stats import format_stats
+from bot.cookies import cookie_provider
+from bot.transcoder import transcoder
+from bot.utils import route_url
 
-class VideoDownloader:
+# Callback для событий загрузки:
+# {'status': 'queued', 'position': int}
+# {'status': 'downloading', 'downloaded_bytes': int, 'total_bytes': int|None, 'speed': float|None, 'eta': int|None}
+StatusCallback = Callable[[dict], Awaitable[None]]
+
+
+class _InflightDownload:
+    """Загрузка, результат которой ожидают один или несколько запросов"""
+    
     def __init__(self):
-        # Пытаемся получить cookies из браузера
-        cookies = None
-        
-        if USE_BROWSER_COOKIES:
+        self.listeners: List[StatusCallback] = []
+        self.future: Optional[asyncio.Future] = None
+    
+    async def notify(self, event: dict):
+        """Передает событие всем ожидающим"""
+        for listener in list(self.listeners):
             try:
-                import browser_cookie3
-                # Пробуем получить cookies из разных браузеров
-                for browser in [browser_cookie3.chrome, browser_cookie3.firefox, 
-                               browser_cookie3.edge, browser_cookie3.opera]:
+                await listener(event)
+            except Exception as e:
+                print(f"⚠️ Status listener failed: {e}")
+
+
+class MetadataCache:
+    """
+    In-process LRU + TTL cache of slimmed extract_info results, optionally mirrored to disk
+    
+    Entries never outlive the signed media URLs inside them.
+    """
+    
+    # Тяжелые поля, не нужные для выбора формата и скачивания
+    _HEAVY_KEYS = (
+        'thumbnails', 'automatic_captions', 'subtitles', 'heatmap', 'chapters',
+        'description', 'tags', 'categories', 'requested_formats', 'requested_downloads',
+        'requested_subtitles', 'comments',
+    )
+    # Параметры ссылок CDN со сроком действия: (имя, основание системы счисления)
+    _EXPIRE_PARAMS = (('expire', 10), ('x-expires', 10), ('oe', 16))
+    # Запас, чтобы ссылка не истекла прямо во время скачивания
+    _EXPIRE_MARGIN = 120
+    
+    def __init__(self, ttl: int, max_entries: int, disk_dir: Optional[Path] = None):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.disk_dir = disk_dir
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+    
+    def _disk_path(self, key: str) -> Path:
+        return self.disk_dir / f"{hashlib.sha1(key.encode()).hexdigest()}.json"
+    
+    def _slim(self, info: dict) -> dict:
+        """Drop fields that are not needed to re-run format selection and download"""
+        slim = {
+            k: v for k, v in info.items()
+            if k not in self._HEAVY_KEYS and not k.startswith('__')
+        }
+        if slim.get('entries'):
+            slim['entries'] = [self._slim(entry) for entry in slim['entries'] if entry]
+        return slim
+    
+    def _expires_at(self, info: dict) -> float:
+        """Earliest expiry of signed media URLs, capped by ttl"""
+        expires_at = time.time() + self.ttl
+        formats = list(info.get('formats') or [])
+        for entry in info.get('entries') or []:
+            formats.extend(entry.get('formats') or [])
+        
+        for fmt in formats:
+            query = parse_qs(urlparse(fmt.get('url') or '').query)
+            for name, base in self._EXPIRE_PARAMS:
+                if name in query:
                     try:
-                        cookies = browser(domain_name='youtube.com')
-                        if cookies:
-                            print(f"✅ Cookies loaded from {browser.__name__}")
-                            break
-                    except:
-                        continue
-            except ImportError:
-                print("⚠️ browser-cookie3 not installed, skipping browser cookies")
-        
-        # Параметры для yt-dlp
+                        expires_at = min(expires_at, int(query[name][0], base) - self._EXPIRE_MARGIN)
+                    except ValueError:
+                        pass
+        return expires_at
+    
+    def get(self, key: str) -> Optional[dict]:
+        """Get a copy of cached info or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None and self.disk_dir:
+                entry = self._load_from_disk(key)
+            
+            if entry is None or entry[0] <= time.time():
+                self._entries.pop(key, None)
+                self.misses += 1
+                return None
+            
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # yt-dlp дополняет форматы при обработке - отдаем копию
+            return copy.deepcopy(entry[1])
+    
+    def put(self, key: str, info: dict):
+        """Store slimmed info"""
+        # Копия: вызывающий код передает тот же словарь в yt-dlp, который его дополняет
+        info = copy.deepcopy(self._slim(info))
+        expires_at = self._expires_at(info)
+        if expires_at <= time.time():
+            return
+        
+        with self._lock:
+            self._entries[key] = (expires_at, info)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        
+        if self.disk_dir:
+            try:
+                with open(self._disk_path(key), 'w') as f:
+                    json.dump({'expires_at': expires_at, 'info': info}, f)
+            except (OSError, TypeError, ValueError) as e:
+                print(f"⚠️ Error saving metadata cache: {e}")
+    
+    def invalidate(self, key: str):
+        """Drop entry (e.g. media URLs were rejected)"""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.disk_dir and self._disk_path(key).exists():
+            self._disk_path(key).unlink()
+    
+    def _load_from_disk(self, key: str) -> Optional[Tuple[float, dict]]:
+        path = self._disk_path(key)
+        if not path.exists():
+            return None
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if data['expires_at'] <= time.time():
+            path.unlink()
+            return None
+        return data['expires_at'], data['info']
+    
+    def cleanup_disk(self):
+        """Remove expired on-disk entries"""
+        if not self.disk_dir:
+            return
+        now = time.time()
+        for path in self.disk_dir.glob('*.json'):
+            try:
+                if path.stat().st_mtime + self.ttl < now:
+                    path.unlink()
+            except OSError:
+                pass
+    
+    def stats(self) -> dict:
+        """Hit/miss counters"""
+        total = self.hits + self.misses
+        return {
+            'entries': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+
+class YoutubeDLPool:
+    """
+    Warm YoutubeDL instances: one per worker thread, platform and cookie file
+    
+    An instance keeps its option parsing, extractor setup, HTTP connection pool
+    and cookie jar between jobs. Per-job options (format, outtmpl, progress hook,
+    fragment settings) are applied in place and restored after the job.
+    """
+    
+    def __init__(self, base_opts: dict):
+        self.base_opts = base_opts
+        self.created = 0
+        self.reused = 0
+        self._local = threading.local()
+        # Хуки текущих задач: id экземпляра -> хук. События фрагментов HLS/DASH приходят
+        # из потоков yt-dlp, поэтому хук ищется по экземпляру, а не по потоку
+        self._hooks: Dict[int, Callable[[dict], None]] = {}
+        self._hooks_lock = threading.Lock()
+    
+    @staticmethod
+    def _instance_key(platform: str, cookiefile: Optional[str]) -> tuple:
+        """Instance key; includes cookie file mtime so updated cookies get a new instance"""
+        try:
+            cookies_mtime = os.path.getmtime(cookiefile) if cookiefile else None
+        except OSError:
+            cookies_mtime = None
+        return (platform, cookiefile, cookies_mtime)
+    
+    def _get_instance(self, platform: str, cookiefile: Optional[str]):
+        instances = getattr(self._local, 'instances', None)
+        if instances is None:
+            instances = self._local.instances = {}
+        
+        key = self._instance_key(platform, cookiefile)
+        ydl = instances.get(key)
+        if ydl is None:
+            # yt_dlp импортируется лениво в рабочем потоке - не замедляет запуск бота
+            import yt_dlp
+            
+            # Экземпляры со старыми cookies этого файла больше не нужны
+            for stale_key in [k for k in instances if k[:2] == key[:2]]:
+                self._discard_instance(stale_key)
+            
+            opts = dict(self.base_opts)
+            if cookiefile:
+                opts['cookiefile'] = cookiefile
+            ydl = yt_dlp.YoutubeDL(opts)
+            # Постоянный хук пересылает события хуку текущей задачи этого экземпляра
+            ydl.add_progress_hook(lambda d, instance_id=id(ydl): self._dispatch_progress(instance_id, d))
+            instances[key] = ydl
+            self.created += 1
+        else:
+            self.reused += 1
+        return key, ydl
+    
+    def _dispatch_progress(self, instance_id: int, d):
+        with self._hooks_lock:
+            hook = self._hooks.get(instance_id)
+        if hook:
+            hook(d)
+    
+    def _discard_instance(self, key: tuple):
+        ydl = self._local.instances.pop(key, None)
+        if ydl:
+            with self._hooks_lock:
+                self._hooks.pop(id(ydl), None)
+            try:
+                ydl.close()
+            except Exception:
+                pass
+    
+    @contextmanager
+    def job(self, platform: str, cookiefile: Optional[str], opts: Optional[dict] = None,
+            progress_hook: Optional[Callable[[dict], None]] = None):
+        """Warm instance of the current thread with per-job options applied"""
+        instance_key, ydl = self._get_instance(platform, cookiefile)
+        opts = dict(opts or {})
+        
+        saved_selector = ydl.format_selector
+        saved_outtmpl = ydl.params['outtmpl'].get('default')
+        job_keys = [key for key in opts if key not in ('format', 'outtmpl')]
+        saved_params = {key: ydl.params[key] for key in job_keys if key in ydl.params}
+        # Ключи, которых у экземпляра не было: после задачи удаляем, а не пишем None
+        added_keys = [key for key in job_keys if key not in ydl.params]
+        
+        if 'format' in opts:
+            ydl.format_selector = ydl.build_format_selector(opts.pop('format'))
+        if 'outtmpl' in opts:
+            ydl.params['outtmpl']['default'] = opts.pop('outtmpl')
+        ydl.params.update(opts)
+        if progress_hook:
+            with self._hooks_lock:
+                self._hooks[id(ydl)] = progress_hook
+        
+        try:
+            yield ydl
+        except Exception:
+            # После ошибки состояние экземпляра непредсказуемо - создадим новый
+            self._discard_instance(instance_key)
+            raise
+        finally:
+            with self._hooks_lock:
+                self._hooks.pop(id(ydl), None)
+            ydl.format_selector = saved_selector
+            ydl.params['outtmpl']['default'] = saved_outtmpl
+            ydl.params.update(saved_params)
+            for key in added_keys:
+                ydl.params.pop(key, None)
+
+
+# Очередь событий прогресса (задана только в рабочих процессах движка 'process')
+_worker_progress_queue = None
+# Получатели событий прогресса в основном процессе: job_id -> callable
+_progress_sinks: Dict[str, Callable[[dict], None]] = {}
+
+
+def _init_process_worker(progress_queue, cookiefiles: Dict[str, Optional[str]]):
+    """Initializer of download worker processes: pre-import yt-dlp and warm the instances jobs use"""
+    global _worker_progress_queue
+    _worker_progress_queue = progress_queue
+    # Ключи совпадают с ключами задач: платформа + файл cookies, уже найденный основным процессом
+    for platform, cookiefile in cookiefiles.items():
+        downloader.ydl_pool._get_instance(platform, cookiefile)
+
+
+def _report_progress(job_id: str, event: dict):
+    """Forward progress event to the main process (directly or over IPC)"""
+    if _worker_progress_queue is not None:
+        _worker_progress_queue.put((job_id, event))
+        return
+    sink = _progress_sinks.get(job_id)
+    if sink:
+        sink(event)
+
+
+def _compact_info(info: dict) -> dict:
+    """Slim info for the job result; plain JSON types when it crosses the process boundary"""
+    slim = downloader.metadata_cache._slim(info)
+    if _worker_progress_queue is not None:
+        # HTTPHeaderDict и другие классы yt-dlp не восстанавливаются из pickle в основном процессе
+        slim = json.loads(json.dumps(slim, default=str))
+    return slim
+
+
+class _ProgressTracker:
+    """yt-dlp progress hook: size guard and throttled progress reports (runs in the worker)"""
+    
+    def __init__(self, job_id: str, max_size: int):
+        self.job_id = job_id
+        self.max_size = max_size
+        self.size_exceeded = False
+        # Байты уже скачанных дорожек (видео + аудио скачиваются по очереди)
+        self.completed_bytes = 0
+        self.last_report = 0.0
+    
+    def __call__(self, d):
+        if d['status'] == 'finished':
+            self.completed_bytes += d.get('downloaded_bytes') or d.get('total_bytes') or 0
+            return
+        if d['status'] != 'downloading':
+            return
+        
+        downloaded = self.completed_bytes + (d.get('downloaded_bytes') or 0)
+        exact_total = d.get('total_bytes')
+        total = exact_total or d.get('total_bytes_estimate')
+        expected = self.completed_bytes + total if total else None
+        
+        # Оценка размера для HLS/DASH неточна - прерываем только по факту или точному размеру
+        if downloaded > self.max_size or (exact_total and expected > self.max_size):
+            self.size_exceeded = True
+            raise Exception(f"Размер превысил лимит сервера: {expected or downloaded} > {self.max_size}")
+        
+        # Редкие и компактные события - в том числе ради IPC
+        now = time.monotonic()
+        if now - self.last_report >= PROGRESS_UPDATE_INTERVAL:
+            self.last_report = now
+            _report_progress(self.job_id, {
+                'downloaded_bytes': downloaded,
+                'total_bytes': expected,
+                'speed': d.get('speed'),
+                'eta': d.get('eta'),
+            })
+
+
+def _run_probe(url: str, platform: str, cookiefile: Optional[str]) -> dict:
+    """
+    Extract metadata without downloading (runs in a worker thread or process)
+    
+    Returns compact result: {'info': slim info | None, 'error': str | None, 'unrecoverable': bool}
+    """
+    try:
+        with downloader.ydl_pool.job(platform, cookiefile) as ydl:
+            info = ydl.extract_info(url, download=False)
+    except Exception as e:
+        return {'info': None, 'error': str(e), 'unrecoverable': downloader._is_unrecoverable(e)}
+    return {
+        'info': _compact_info(info) if info else None,
+        'error': None,
+        'unrecoverable': False,
+    }
+
+
+def _run_download(job_id: str, platform: str, cookiefile: Optional[str],
+                  info: dict, job_opts: dict, max_size: int) -> dict:
+    """
+    Download already probed video (runs in a worker thread or process)
+    
+    Returns compact result: {'info', 'error', 'unrecoverable', 'size_exceeded'}
+    """
+    tracker = _ProgressTracker(job_id, max_size)
+    try:
+        # Используем уже полученные метаданные - без повторного извлечения
+        with downloader.ydl_pool.job(platform, cookiefile, job_opts, tracker) as ydl:
+            result = ydl.process_ie_result(info, download=True)
+    except Exception as e:
+        return {
+            'info': None,
+            'error': str(e),
+            'unrecoverable': not tracker.size_exceeded and downloader._is_unrecoverable(e),
+            'size_exceeded': tracker.size_exceeded,
+        }
+    return {
+        'info': _compact_info(result) if result else None,
+        'error': None,
+        'unrecoverable': False,
+        'size_exceeded': tracker.size_exceeded,
+    }
+
+
+class VideoDownloader:
+    # Запасные форматы на случай, если выбранный по размеру не скачался
+    _FALLBACK_FORMATS = (
+        'best[ext=mp4]',
+        'best',
+        'worst',  # Иногда маленькие файлы работают лучше
+    )
+    
+    # Сообщения yt-dlp об удаленных, приватных и заблокированных видео - их не исправить
+    # сменой формата. Общие слова (unavailable, removed) не подходят: так выглядят и
+    # временные ошибки вроде "HTTP Error 503: Service Unavailable"
+    _UNRECOVERABLE_ERRORS = re.compile(
+        r'video unavailable|video is unavailable|private video|video is private|'
+        r'(has been|was) (removed|deleted)|no longer available|does not exist|'
+        r'not (made this video )?available in your country|not available from your location|'
+        r'geo.?restrict|blocked it in your country|copyright grounds|account.+(terminated|suspended)',
+        re.IGNORECASE
+    )
+    
+    def __init__(self):
+        # Текущие загрузки: video_key -> общая загрузка
+        self._inflight: Dict[str, _InflightDownload] = {}
+        # Счетчики ссылок на временные файлы, общие для объединенных запросов
+        self._file_refs: Dict[str, int] = {}
+        # Сжатие общих временных файлов: исходный путь -> задача transcoder.shrink
+        self._shrinking: Dict[str, asyncio.Task] = {}
+        # Файлы, в которые сейчас пишет yt-dlp
+        self._active_paths = set()
+        # Резерв памяти под файлы в tmpfs: путь -> байт
+        self._ram_reserved: Dict[str, int] = {}
+        self._last_partials_cleanup = 0.0
+        # Очередь загрузок с лимитами по платформам
+        self.scheduler = DownloadScheduler(DOWNLOAD_WORKERS, PLATFORM_DOWNLOAD_LIMITS, DOWNLOAD_QUEUE_SIZE)
+        # ffmpeg нужен для склейки отдельных видео- и аудиодорожек
+        self._has_ffmpeg = shutil.which('ffmpeg') is not None
+        # Статистика выбора формата
+        self.stats = {
+            'format_selections': 0,  # Выборов формата по размеру
+            'kept_in_chat': 0,  # Видео отправлены в чат вместо файлового сервера
+            'ram_staged': 0,  # Загрузок через память (tmpfs) вместо диска
+            'direct_url_attempts': 0,  # Попыток отдать Telegram ссылку CDN
+            'direct_url_sent': 0,  # Из них принято Telegram
+        }
+        # Измеренная скорость загрузки по платформам - для настройки FRAGMENT_DOWNLOAD_SETTINGS
+        self.throughput: Dict[str, dict] = {}
+        # Кэш метаданных extract_info по каноническому id видео
+        self.metadata_cache = MetadataCache(
+            METADATA_CACHE_TTL, METADATA_CACHE_MAX_ENTRIES,
+            METADATA_CACHE_DIR if METADATA_CACHE_DISK else None
+        )
+        
+        # Параметры для yt-dlp (cookies подставляются при загрузке, см. cookie_provider)
         self.ydl_opts = {
             'quiet': True,
             'no_warnings': True,
@@ -46,6 +493,7 @@ class VideoDownloader:
             'geo_bypass_country': 'US',
             'user_agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36',
             'referer': 'https://www.youtube.com/',
+            'merge_output_format': 'mp4',
             'headers': {
                 'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,*/*;q=0.8',
                 'Accept-Language': 'en-US,en;q=0.9',
@@ -56,34 +504,56 @@ class VideoDownloader:
             },
         }
         
-        # Добавляем cookies если есть
-        if cookies:
-            try:
-                # Сохраняем cookies во временный файл
-                import tempfile
-                import pickle
-                
-                temp_cookie_file = tempfile.NamedTemporaryFile(delete=False, suffix='.txt')
-                for cookie in cookies:
-                    if cookie.name and cookie.value:
-                        temp_cookie_file.write(f"{cookie.domain}\tTRUE\t{cookie.path}\t{cookie.secure}\t{cookie.expires}\t{cookie.name}\t{cookie.value}\n".encode())
-                temp_cookie_file.close()
-                
-                self.ydl_opts['cookiefile'] = temp_cookie_file.name
-                self.temp_cookie_file = temp_cookie_file.name
-            except Exception as e:
-                print(f"⚠️ Error loading cookies: {e}")
-                self.temp_cookie_file = None
-        elif COOKIES_FILE and os.path.exists(COOKIES_FILE):
-            self.ydl_opts['cookiefile'] = COOKIES_FILE
-    
-    def __del__(self):
-        """Очистка временных файлов cookies"""
-        if hasattr(self, 'temp_cookie_file') and self.temp_cookie_file and os.path.exists(self.temp_cookie_file):
-            try:
-                os.unlink(self.temp_cookie_file)
-            except:
-                pass
+        # Прогретые экземпляры YoutubeDL; ошибки должны доходить до нас,
+        # чтобы отличать неисправимые от временных
+        self.ydl_pool = YoutubeDLPool({**self.ydl_opts, 'ignoreerrors': False, 'noprogress': True})
+        
+        # Где выполняется yt-dlp: потоки бота или отдельные процессы (создаются при первой загрузке)
+        self.engine = 'process' if DOWNLOAD_ENGINE == 'process' else 'thread'
+        self._process_pool: Optional[ProcessPoolExecutor] = None
+        self._progress_queue = None
+    
+    def _get_process_pool(self) -> ProcessPoolExecutor:
+        """Worker processes for the 'process' engine"""
+        if self._process_pool is None:
+            # spawn: fork процесса с потоками и event loop небезопасен
+            context = multiprocessing.get_context('spawn')
+            if self._progress_queue is None:
+                self._progress_queue = context.Queue()
+                threading.Thread(target=self._pump_progress, name='download-progress', daemon=True).start()
+            # Только уже загруженные cookies - без блокирующего поиска в event loop
+            cookiefiles = {
+                platform: cookie_provider.cached_cookiefile(platform)
+                for platform in PLATFORM_DOWNLOAD_LIMITS
+            }
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=DOWNLOAD_WORKERS,
+                mp_context=context,
+                initializer=_init_process_worker,
+                initargs=(self._progress_queue, cookiefiles),
+            )
+            print(f"⚙️ Started {DOWNLOAD_WORKERS} download worker processes")
+        return self._process_pool
+    
+    def _pump_progress(self):
+        """Deliver progress events from worker processes to their sinks"""
+        while True:
+            job_id, event = self._progress_queue.get()
+            sink = _progress_sinks.get(job_id)
+            if sink:
+                sink(event)
+    
+    async def _run_in_engine(self, func, *args):
+        """Run yt-dlp job function in the configured engine"""
+        loop = asyncio.get_event_loop()
+        if self.engine == 'thread':
+            return await loop.run_in_executor(self.scheduler.executor, func, *args)
+        try:
+            return await loop.run_in_executor(self._get_process_pool(), func, *args)
+        except BrokenProcessPool:
+            # Рабочий процесс упал - следующая задача получит новый пул
+            self._process_pool = None
+            raise
     
     def _generate_temp_filename(self, platform: str) -> str:
         """Generate unique temporary filename"""
@@ -97,94 +567,738 @@ class VideoDownloader:
         random_str = ''.join(random.choices(string.ascii_lowercase + string.digits, k=6))
         return f"{platform}_{timestamp}_{random_str}.mp4"
     
+    def _partial_filename(self, platform: str, video_id: str, format_spec: str) -> str:
+        """Deterministic temp filename for video + format, so partial downloads can be resumed"""
+        digest = hashlib.sha1(f"{video_id}|{format_spec}".encode()).hexdigest()[:16]
+        return f"temp_{platform}_{digest}.mp4"
+    
+    @staticmethod
+    def _partial_size(temp_filepath: Path) -> int:
+        """Bytes already downloaded into .part files of this temp file"""
+        return sum(
+            part.stat().st_size
+            for part in temp_filepath.parent.glob(f"{temp_filepath.stem}*.part")
+        )
+    
+    def _discard_partial(self, temp_filepath: Path):
+        """Delete temp file and its partial pieces (.part, .ytdl, separate tracks)"""
+        if str(temp_filepath) in self._file_refs:
+            return
+        self._ram_reserved.pop(str(temp_filepath), None)
+        for path in temp_filepath.parent.glob(f"{temp_filepath.stem}*"):
+            try:
+                path.unlink()
+            except OSError:
+                pass
+    
+    def _maybe_cleanup_partials(self):
+        """Remove abandoned partial downloads older than PARTIAL_DOWNLOAD_MAX_AGE_HOURS"""
+        now = time.time()
+        if now - self._last_partials_cleanup < 600:
+            return
+        self._last_partials_cleanup = now
+        self.metadata_cache.cleanup_disk()
+        
+        expire_before = now - PARTIAL_DOWNLOAD_MAX_AGE_HOURS * 3600
+        busy = self._active_paths | set(self._file_refs)
+        ram_files = list(RAM_STAGING_DIR.iterdir()) if RAM_STAGING_DIR.is_dir() else []
+        for path in [*TEMP_DOWNLOADS_DIR.iterdir(), *INCOMING_DIR.iterdir(), *ram_files]:
+            try:
+                if not path.is_file() or path.stat().st_mtime > expire_before:
+                    continue
+                if any(path.name.startswith(Path(b).stem) for b in busy):
+                    continue
+                path.unlink()
+                print(f"🧹 Removed stale partial download {path.name}")
+            except OSError:
+                pass
+    
     def _get_platform_from_url(self, url: str) -> str:
         """Detect platform from URL"""
-        url_lower = url.lower()
-        if 'instagram.com' in url_lower:
-            return 'instagram'
-        elif 'tiktok.com' in url_lower or 'vt.tiktok.com' in url_lower:
-            return 'tiktok'
-        elif 'youtube.com' in url_lower or 'youtu.be' in url_lower:
-            return 'youtube'
-        return 'unknown'
+        route = route_url(url)
+        return route.platform if route else 'unknown'
+    
+    def get_video_key(self, url: str) -> str:
+        """Canonical video identity (platform + video id) without network access"""
+        route = route_url(url)
+        if route and route.canonical_id:
+            return route.canonical_id
+        # id не виден в ссылке - ключом служит сама ссылка без схемы
+        parts = urlsplit(url.strip())
+        return f"url:{(parts.hostname or '')}{parts.path.rstrip('/')}?{parts.query}"
+    
+    def _reserve_ram(self, size: Optional[int]) -> bool:
+        """Reserve memory budget for a tmpfs download; False if it should go to disk"""
+        if not size or size > RAM_STAGING_MAX_FILE_SIZE or RAM_STAGING_BUDGET <= 0:
+            return False
+        if sum(self._ram_reserved.values()) + size > RAM_STAGING_BUDGET:
+            return False
+        try:
+            RAM_STAGING_DIR.mkdir(exist_ok=True)
+            # Реальный размер tmpfs может быть меньше бюджета (в Docker /dev/shm - 64MB)
+            return shutil.disk_usage(RAM_STAGING_DIR).free >= size * 2
+        except OSError:
+            return False
+    
+    def _acquire_file(self, filepath: str):
+        """Увеличивает счетчик пользователей временного файла"""
+        self._file_refs[filepath] = self._file_refs.get(filepath, 0) + 1
+    
+    def release_file(self, filepath: str):
+        """Освобождает временный файл; удаляет его, когда он больше никому не нужен"""
+        refs = self._file_refs.get(filepath, 1) - 1
+        if refs > 0:
+            self._file_refs[filepath] = refs
+            return
+        self._file_refs.pop(filepath, None)
+        self._ram_reserved.pop(filepath, None)
+        self._shrinking.pop(filepath, None)
+        if Path(filepath).exists():
+            Path(filepath).unlink()
+    
+    async def shrink_file(self, temp_filepath: str, video_bitrate: int, max_size: int) -> Optional[str]:
+        """
+        Transcode temp file to fit max_size, once per shared file
+        
+        Merged requests of the same download get the same transcoded file. On success
+        the caller's reference moves from temp_filepath to the returned file.
+        """
+        task = self._shrinking.get(temp_filepath)
+        if task is not None and task.done():
+            result = None if task.cancelled() or task.exception() else task.result()
+            if result and not Path(result).exists():
+                # Сжатую копию уже отправили и удалили другие запросы
+                task = None
+        if task is None:
+            task = asyncio.ensure_future(transcoder.shrink(temp_filepath, video_bitrate, max_size))
+            self._shrinking[temp_filepath] = task
+        
+        shrunk_filepath = await asyncio.shield(task)
+        if not shrunk_filepath:
+            return None
+        self._acquire_file(shrunk_filepath)
+        self.release_file(temp_filepath)
+        return shrunk_filepath
+    
+    # Ошибки, при которых переименование/жесткая ссылка невозможны и нужна копия
+    _COPY_FALLBACK_ERRNOS = (errno.EXDEV, errno.EPERM, errno.ENOTSUP, errno.EMLINK)
+    
+    async def move_to_server_storage(self, temp_filepath: str, platform: str) -> str:
+        """
+        Promote downloaded temp file into VIDEOS_DIR
+        
+        Same filesystem: atomic rename, or a hardlink while other requests still use
+        the temp file. Otherwise: streaming copy into a hidden name, fsync, atomic rename.
+        Releases the caller's reference to temp_filepath.
+        
+        Returns:
+            final filename in VIDEOS_DIR
+        """
+        final_filename = self._generate_final_filename(platform)
+        final_path = VIDEOS_DIR / final_filename
+        shared = self._file_refs.get(temp_filepath, 1) > 1
+        
+        try:
+            if shared:
+                os.link(temp_filepath, final_path)
+            else:
+                os.replace(temp_filepath, final_path)
+                self._file_refs.pop(temp_filepath, None)
+                self._shrinking.pop(temp_filepath, None)
+                return final_filename
+        except OSError as e:
+            if e.errno not in self._COPY_FALLBACK_ERRNOS:
+                raise
+            print(f"💾 Copying {Path(temp_filepath).name} to storage ({e.strerror})")
+            loop = asyncio.get_event_loop()
+            await loop.run_in_executor(self.scheduler.executor, self._copy_to_storage, temp_filepath, final_path)
+        
+        self.release_file(temp_filepath)
+        return final_filename
+    
+    @staticmethod
+    def _copy_to_storage(source: str, final_path: Path):
+        """Copy file into storage; it appears under its final name only when complete"""
+        hidden_path = final_path.with_name(f".{final_path.name}.part")
+        try:
+            # copyfile использует sendfile - данные не проходят через буферы Python
+            shutil.copyfile(source, hidden_path)
+            with open(hidden_path, 'rb') as f:
+                os.fsync(f.fileno())
+            os.replace(hidden_path, final_path)
+        except BaseException:
+            hidden_path.unlink(missing_ok=True)
+            raise
+    
+    def _fragment_opts(self, platform: str) -> dict:
+        """yt-dlp options for parallel fragment downloads on this platform"""
+        settings = FRAGMENT_DOWNLOAD_SETTINGS.get(platform) or FRAGMENT_DOWNLOAD_SETTINGS['unknown']
+        opts = {'concurrent_fragment_downloads': settings['concurrent_fragments']}
+        if settings.get('http_chunk_size'):
+            opts['http_chunk_size'] = settings['http_chunk_size']
+        return opts
+    
+    def _record_throughput(self, platform: str, size: int, seconds: float):
+        """Update average download speed for platform"""
+        if seconds <= 0:
+            return
+        speed = size / seconds
+        entry = self.throughput.setdefault(platform, {
+            'downloads': 0,
+            'avg_bytes_per_sec': 0.0,
+            'concurrent_fragments': self._fragment_opts(platform)['concurrent_fragment_downloads'],
+        })
+        entry['avg_bytes_per_sec'] = (
+            speed if entry['downloads'] == 0
+            else entry['avg_bytes_per_sec'] * 0.8 + speed * 0.2
+        )
+        entry['downloads'] += 1
+    
+    def _is_unrecoverable(self, error: Exception) -> bool:
+        """Private, removed or geo-blocked video - retrying other formats is pointless"""
+        import yt_dlp
+        
+        # DownloadError хранит исходное исключение экстрактора в exc_info
+        original = (getattr(error, 'exc_info', None) or (None, None))[1]
+        for exc in (error, original):
+            # UnavailableVideoError не подходит: yt-dlp оборачивает в нее и ошибки ввода-вывода
+            if isinstance(exc, yt_dlp.utils.GeoRestrictedError):
+                return True
+        return bool(self._UNRECOVERABLE_ERRORS.search(str(error)))
+    
+    @staticmethod
+    def _short_error(error) -> str:
+        """yt-dlp error message without the 'ERROR: [extractor] id:' prefix"""
+        message = str(error).replace('ERROR: ', '')
+        message = re.sub(r'^\[[^\]]+\]\s*[^:]*:\s*', '', message)
+        return message[:200]
+    
+    @staticmethod
+    def _estimate_format_size(fmt: dict, duration: Optional[float]) -> Optional[int]:
+        """Estimate format size: filesize, filesize_approx or bitrate × duration"""
+        size = fmt.get('filesize') or fmt.get('filesize_approx')
+        if size:
+            return int(size)
+        # tbr в кбит/с
+        if fmt.get('tbr') and duration:
+            return int(fmt['tbr'] * 1000 / 8 * duration)
+        return None
+    
+    def _format_candidates(self, info: dict) -> List[dict]:
+        """
+        Candidate renditions ranked from worst to best quality
+        
+        Each candidate: {'spec', 'size', 'height', 'tbr', 'ext'}. Besides single-file
+        formats, mp4 video + m4a audio pairs are considered when ffmpeg is available.
+        """
+        duration = info.get('duration')
+        formats = info.get('formats') or []
+        candidates = []
+        
+        for f in formats:
+            if f.get('vcodec') != 'none' and f.get('acodec') != 'none':
+                candidates.append({
+                    'spec': f['format_id'],
+                    'size': self._estimate_format_size(f, duration),
+                    'height': f.get('height') or 0,
+                    'tbr': f.get('tbr') or 0,
+                    'ext': f.get('ext'),
+                })
+        
+        if self._has_ffmpeg:
+            audio = [
+                f for f in formats
+                if f.get('vcodec') == 'none' and f.get('acodec') not in (None, 'none') and f.get('ext') == 'm4a'
+            ]
+            if audio:
+                best_audio = audio[-1]
+                audio_size = self._estimate_format_size(best_audio, duration)
+                for f in formats:
+                    if f.get('acodec') == 'none' and f.get('vcodec') not in (None, 'none') and f.get('ext') == 'mp4':
+                        video_size = self._estimate_format_size(f, duration)
+                        candidates.append({
+                            'spec': f"{f['format_id']}+{best_audio['format_id']}",
+                            'size': video_size + audio_size if video_size and audio_size else None,
+                            'height': f.get('height') or 0,
+                            'tbr': (f.get('tbr') or 0) + (best_audio.get('tbr') or 0),
+                            'ext': 'mp4',
+                        })
+        
+        candidates.sort(key=lambda c: (c['height'], c['ext'] == 'mp4', c['tbr']))
+        return candidates
+    
+    def _select_format(
+        self, 
+        info: dict, 
+        max_size: int, 
+        prefer_chat: bool = True,
+        record_stats: bool = True
+    ) -> Tuple[Optional[str], Optional[int]]:
+        """
+        Choose the best rendition that fits max_size
+        
+        With prefer_chat the best rendition fitting the chat limit wins over
+        a better one that could only be delivered through the file server.
+        
+        Returns:
+            (format_spec, estimated_size) - format_spec is None if nothing fits;
+            estimated_size is None if sizes are unknown and the download-time check must decide
+        """
+        candidates = self._format_candidates(info)
+        known = [c for c in candidates if c['size'] is not None]
+        fitting = [c for c in known if c['size'] <= max_size]
+        
+        if not fitting:
+            if not known or len(known) < len(candidates):
+                return None, None
+            return None, min(c['size'] for c in known)
+        
+        best = fitting[-1]
+        if record_stats:
+            self.stats['format_selections'] += 1
+        
+        if prefer_chat:
+            chat_limit = min(max_size, DEFAULT_MAX_CHAT_SIZE)
+            fitting_chat = [c for c in fitting if c['size'] <= chat_limit]
+            if fitting_chat and best['size'] > chat_limit:
+                # Отдаем чуть меньшее качество, но видео уйдет в чат, а не на сервер
+                if record_stats:
+                    self.stats['kept_in_chat'] += 1
+                best = fitting_chat[-1]
+        
+        return best['spec'], best['size']
+    
+    async def _get_info(self, url: str, platform: str, cookiefile: Optional[str]) -> dict:
+        """
+        Metadata from cache or a fresh probe
+        
+        Returns compact probe result: {'info', 'error', 'unrecoverable'}
+        """
+        cache_key = self.get_video_key(url)
+        loop = asyncio.get_event_loop()
+        # Кэш может читать диск - не блокируем цикл событий
+        info = await loop.run_in_executor(self.scheduler.executor, self.metadata_cache.get, cache_key)
+        if info is not None:
+            return {'info': info, 'error': None, 'unrecoverable': False}
+        
+        try:
+            probe = await self._run_in_engine(_run_probe, url, platform, cookiefile)
+        except Exception as e:
+            probe = {'info': None, 'error': str(e), 'unrecoverable': False}
+        
+        if probe['error']:
+            print(f"⚠️ Probe failed: {probe['error']}")
+        if probe['info']:
+            await loop.run_in_executor(self.scheduler.executor, self.metadata_cache.put, cache_key, probe['info'])
+        return probe
+    
+    @staticmethod
+    def _is_direct_url_format(fmt: dict) -> bool:
+        """Single progressive mp4 over plain HTTPS that a third party can fetch"""
+        if fmt.get('ext') != 'mp4' or fmt.get('protocol') not in ('https', 'http'):
+            return False
+        if fmt.get('vcodec') in (None, 'none') or fmt.get('acodec') in (None, 'none'):
+            return False
+        # Ссылки, привязанные к нашему IP (googlevideo ip=...), с серверов Telegram не откроются
+        return 'ip' not in parse_qs(urlparse(fmt.get('url') or '').query)
+    
+    def _direct_url(self, info: dict, platform: str, max_server_size: int, prefer_chat: bool) -> Optional[dict]:
+        """
+        Media URL that Telegram can fetch itself instead of us downloading the video
+        
+        Only when the rendition the regular download would pick is a single progressive
+        mp4 under DIRECT_URL_MAX_SIZE.
+        
+        Returns:
+            {'_type': 'direct_url', 'url', 'format_id', 'size', 'title', 'duration', 'platform'} or None
+        """
+        format_id, size = self._select_format(info, max_server_size, prefer_chat, record_stats=False)
+        if not format_id or not size or size > DIRECT_URL_MAX_SIZE:
+            return None
+        fmt = next((f for f in info.get('formats') or [] if f.get('format_id') == format_id), None)
+        if not fmt or not self._is_direct_url_format(fmt):
+            return None
+        
+        return {
+            '_type': 'direct_url',
+            'url': fmt['url'],
+            'format_id': format_id,
+            'size': size,
+            'title': info.get('title'),
+            'duration': info.get('duration'),
+            'platform': platform,
+        }
     
     async def download_with_size_check(
         self, 
         url: str, 
-        max_server_size: int
+        max_server_size: int,
+        on_status: Optional[StatusCallback] = None,
+        prefer_chat: bool = True,
+        user_id: Optional[int] = None,
+        allow_direct: bool = False
     ) -> Tuple[Optional[str], Optional[Dict], Optional[str], Optional[str]]:
         """
         Download video with real-time size checking
         
+        prefer_chat picks the best rendition under the chat limit when one exists
+        instead of the best one overall. user_id is used for fair queueing between users.
+        With allow_direct (and DIRECT_URL_DELIVERY) a small progressive mp4 is not
+        downloaded: video_info comes back as the _direct_url() dict and temp_filepath is None.
+        If Telegram rejects that URL, call again without allow_direct - the probe is cached.
+        Concurrent requests for the same video and size limit share one download.
+        Playlists (Instagram carousels) come back with video_info['_type'] == 'playlist'
+        and a 'filepath' in every entry; temp_filepath is then the first entry's file.
+        Every file from result_files() must be handed back via release_file().
+        on_status receives queue events ({'status': 'queued', 'position': N}, 0 = started)
+        and throttled progress events ({'status': 'downloading', ...}).
+        
         Returns:
             (temp_filepath, video_info, platform, error_message)
         """
+        allow_direct = allow_direct and DIRECT_URL_DELIVERY
+        # Лимит входит в ключ: формат выбирается по лимиту, и загрузка с большим лимитом
+        # может взять рендер, который не влезет в меньший
+        key = (
+            f"{self.get_video_key(url)}|{'chat' if prefer_chat else 'quality'}|{max_server_size}"
+            f"{'|direct' if allow_direct else ''}"
+        )
+        inflight = self._inflight.get(key)
+        
+        # Присоединяемся к уже идущей загрузке с теми же параметрами
+        if inflight is None:
+            download = _InflightDownload()
+            download.future = asyncio.ensure_future(
+                self._download(url, max_server_size, prefer_chat, download.notify, user_id, allow_direct)
+            )
+            self._inflight[key] = download
+            download.future.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            download = inflight
+            print(f"🔁 Joining in-flight download for {key}")
+        
+        if on_status:
+            download.listeners.append(on_status)
+        future = download.future
+        
+        # shield: отмена одного ожидающего не должна прерывать общую загрузку
+        temp_filepath, info, platform, error = await asyncio.shield(future)
+        if error or not temp_filepath:
+            return temp_filepath, info, platform, error
+        
+        files = self.result_files(temp_filepath, info)
+        for filepath in files:
+            self._acquire_file(filepath)
+        final_size = sum(Path(filepath).stat().st_size for filepath in files)
+        if final_size > max_server_size:
+            for filepath in files:
+                self.release_file(filepath)
+            return None, None, None, f"Видео слишком большое! Размер: {final_size // (1024*1024)}MB, лимит: {max_server_size // (1024*1024)}MB"
+        
+        return temp_filepath, info, platform, None
+    
+    @staticmethod
+    def result_files(temp_filepath: str, info: Optional[dict]) -> List[str]:
+        """All files of a download result: one video or every entry of a playlist"""
+        if info and info.get('_type') == 'playlist':
+            return [entry['filepath'] for entry in info['entries']]
+        return [temp_filepath]
+    
+    async def _download(
+        self, 
+        url: str, 
+        max_server_size: int,
+        prefer_chat: bool,
+        notify: StatusCallback,
+        user_id: Optional[int] = None,
+        allow_direct: bool = False
+    ) -> Tuple[Optional[str], Optional[Dict], Optional[str], Optional[str]]:
+        """Download video once; result is shared between coalesced requests"""
+        async def on_position(position: int):
+            await notify({'status': 'queued', 'position': position})
+        
+        # Администраторы получают больше слотов, когда очередь занята
+        weight = ADMIN_SCHEDULER_WEIGHT if user_id in ADMIN_IDS else 1
+        try:
+            async with self.scheduler.slot(self._get_platform_from_url(url), on_position, user_id, weight):
+                return await self._download_in_slot(
+                    url, max_server_size, prefer_chat, notify, allow_direct, user_id, weight
+                )
+        except QueueFullError:
+            return None, None, None, "Очередь загрузок переполнена. Попробуйте через несколько минут."
+    
+    async def _download_in_slot(
+        self, 
+        url: str, 
+        max_server_size: int,
+        prefer_chat: bool,
+        notify: StatusCallback,
+        allow_direct: bool = False,
+        user_id: Optional[int] = None,
+        weight: float = 1
+    ) -> Tuple[Optional[str], Optional[Dict], Optional[str], Optional[str]]:
+        """Download video in a scheduler slot (user_id and weight: for extra slots of playlists)"""
         loop = asyncio.get_event_loop()
         platform = self._get_platform_from_url(url)
-        temp_filename = self._generate_temp_filename(platform)
-        temp_filepath = TEMP_DOWNLOADS_DIR / temp_filename
-        
-        # Флаг для отслеживания превышения размера
-        size_exceeded = False
-        
-        def progress_hook(d):
-            """Progress hook для отслеживания размера"""
-            nonlocal size_exceeded
-            if d['status'] == 'downloading':
-                if temp_filepath.exists():
-                    current_size = temp_filepath.stat().st_size
-                    if current_size > max_server_size:
-                        size_exceeded = True
-                        raise Exception(f"Размер превысил лимит сервера: {current_size} > {max_server_size}")
-        
-        # Пробуем разные форматы
-        formats_to_try = [
-            'best[ext=mp4]',
-            'best',
-            'worst',  # Иногда маленькие файлы работают лучше
+        self._maybe_cleanup_partials()
+        
+        # Cookies загружаются лениво при первом обращении к платформе
+        cookiefile = await loop.run_in_executor(
+            self.scheduler.executor, cookie_provider.get_cookiefile, platform
+        )
+        
+        # Получаем метаданные без скачивания (или берем из кэша)
+        cache_key = self.get_video_key(url)
+        probe = await self._get_info(url, platform, cookiefile)
+        if probe['unrecoverable']:
+            return None, None, None, f"Видео недоступно: {self._short_error(probe['error'])}"
+        probed_info = probe['info']
+        
+        if not probed_info:
+            return None, None, None, "Не удалось получить информацию о видео. Возможно, оно приватное или удалено."
+        
+        if probed_info.get('_type') == 'playlist':
+            entries = [entry for entry in probed_info.get('entries') or [] if entry]
+            if not entries:
+                return None, None, None, "В публикации нет видео."
+            if len(entries) > 1:
+                return await self._download_playlist(
+                    url, probed_info, entries, platform, cookiefile, cache_key,
+                    max_server_size, prefer_chat, notify, user_id, weight
+                )
+            # Пост с одним видео - обычная загрузка
+            probed_info = entries[0]
+        
+        # Небольшой progressive mp4 - пусть Telegram сам заберет его с CDN
+        if allow_direct:
+            direct = self._direct_url(probed_info, platform, max_server_size, prefer_chat)
+            if direct:
+                return None, direct, platform, None
+        
+        def report(event: dict):
+            """Progress sink (runs in a worker thread or the IPC pump thread)"""
+            asyncio.run_coroutine_threadsafe(notify({'status': 'downloading', **event}), loop)
+        
+        return await self._download_video(
+            url, probed_info, platform, cookiefile, cache_key, max_server_size, prefer_chat, report
+        )
+    
+    async def _download_playlist(
+        self,
+        url: str,
+        playlist_info: dict,
+        entries: List[dict],
+        platform: str,
+        cookiefile: Optional[str],
+        cache_key: str,
+        max_server_size: int,
+        prefer_chat: bool,
+        notify: StatusCallback,
+        user_id: Optional[int] = None,
+        weight: float = 1
+    ) -> Tuple[Optional[str], Optional[Dict], Optional[str], Optional[str]]:
+        """
+        Download playlist entries in parallel (at most PLAYLIST_DOWNLOAD_CONCURRENCY at once)
+        
+        The first worker uses the slot the playlist already holds; every extra worker
+        takes its own scheduler slot, so platform and global limits still apply.
+        Extra workers that are still queued when all entries are taken are cancelled.
+        Failed entries are skipped; the result fails only if nothing was downloaded
+        or all files together exceed max_server_size.
+        """
+        loop = asyncio.get_event_loop()
+        # Последнее событие прогресса каждого видео - показываем сумму
+        progress: Dict[int, dict] = {}
+        
+        def reporter(index: int):
+            def report(event: dict):
+                progress[index] = event
+                events = list(progress.values())
+                totals = [e.get('total_bytes') for e in events]
+                asyncio.run_coroutine_threadsafe(notify({
+                    'status': 'downloading',
+                    'downloaded_bytes': sum(e['downloaded_bytes'] for e in events),
+                    'total_bytes': sum(totals) if len(events) == len(entries) and all(totals) else None,
+                    'resumed_bytes': sum(e.get('resumed_bytes') or 0 for e in events),
+                    'speed': sum(e.get('speed') or 0 for e in events) or None,
+                    'eta': None,
+                }), loop)
+            return report
+        
+        pending = iter(enumerate(entries))
+        finished: Dict[int, tuple] = {}
+        
+        async def drain():
+            """Download entries one by one until none are left"""
+            for index, entry in pending:
+                finished[index] = await self._download_video(
+                    url, entry, platform, cookiefile, cache_key, max_server_size, prefer_chat, reporter(index)
+                )
+        
+        started_workers = set()
+        
+        async def extra_worker(number: int):
+            try:
+                async with self.scheduler.slot(platform, None, user_id, weight):
+                    started_workers.add(number)
+                    await drain()
+            except QueueFullError:
+                pass
+        
+        extra = [
+            asyncio.ensure_future(extra_worker(number))
+            for number in range(min(PLAYLIST_DOWNLOAD_CONCURRENCY, len(entries)) - 1)
         ]
+        try:
+            await drain()
+        finally:
+            # Все видео уже разобраны - ожидающие слот помощники не нужны
+            for number, task in enumerate(extra):
+                if number not in started_workers:
+                    task.cancel()
+            outcomes = await asyncio.gather(*extra, return_exceptions=True)
+        error = next((o for o in outcomes if isinstance(o, Exception)), None)
+        if error:
+            raise error
+        
+        results = [finished[index] for index in sorted(finished)]
+        downloaded = [(path, info) for path, info, _, error in results if path and not error]
+        if not downloaded:
+            return None, None, None, next(error for _, _, _, error in results if error)
+        if len(downloaded) < len(results):
+            print(f"⚠️ Playlist {cache_key}: {len(results) - len(downloaded)} of {len(results)} entries failed")
+        
+        total_size = sum(Path(path).stat().st_size for path, _ in downloaded)
+        if total_size > max_server_size:
+            for path, _ in downloaded:
+                self._discard_partial(Path(path))
+            return None, None, None, f"Публикация слишком большая! Размер: {total_size // (1024*1024)}MB, лимит: {max_server_size // (1024*1024)}MB"
+        
+        info = {key: value for key, value in playlist_info.items() if key != 'entries'}
+        info['entries'] = [{**(entry_info or {}), 'filepath': path} for path, entry_info in downloaded]
+        return downloaded[0][0], info, platform, None
+    
+    async def _download_video(
+        self,
+        url: str,
+        probed_info: dict,
+        platform: str,
+        cookiefile: Optional[str],
+        cache_key: str,
+        max_server_size: int,
+        prefer_chat: bool,
+        report: Callable[[dict], None]
+    ) -> Tuple[Optional[str], Optional[Dict], Optional[str], Optional[str]]:
+        """Download one probed video, trying the selected format and then the fallbacks"""
+        # Сколько байт было скачано до текущей попытки (продолжение загрузки)
+        resumed_bytes = 0
+        
+        def on_progress(event: dict):
+            report({**event, 'resumed_bytes': resumed_bytes})
+        
+        format_id, estimated_size = self._select_format(probed_info, max_server_size, prefer_chat)
+        if format_id is None and estimated_size is not None:
+            return None, None, None, f"Видео слишком большое! Примерный размер: {estimated_size // (1024*1024)}MB, лимит: {max_server_size // (1024*1024)}MB"
+        
+        # Выбранный по размеру формат всегда первый; запасные - в порядке наблюдаемой
+        # успешности для этого экстрактора
+        extractor = probed_info.get('extractor_key') or platform
+        format_specs = {name: name for name in self._FALLBACK_FORMATS}
+        if format_id:
+            format_specs['selected'] = format_id
+        formats_to_try = (['selected'] if format_id else []) + format_stats.order(
+            extractor, list(self._FALLBACK_FORMATS)
+        )
         
-        for format_spec in formats_to_try:
-            ydl_opts = {
-                **self.ydl_opts,
+        video_id = f"{extractor}:{probed_info.get('id') or self.get_video_key(url)}"
+        
+        # Видео для файлового сервера качаем сразу в хранилище - потом только переименование
+        download_dir = (
+            INCOMING_DIR if estimated_size and estimated_size > DEFAULT_MAX_CHAT_SIZE
+            else TEMP_DOWNLOADS_DIR
+        )
+        
+        for format_name in formats_to_try:
+            format_spec = format_specs[format_name]
+            
+            # Небольшое видео с известным размером качаем в память, если хватает бюджета
+            attempt_size = estimated_size if format_name == 'selected' else None
+            in_ram = self._reserve_ram(attempt_size)
+            attempt_dir = RAM_STAGING_DIR if in_ram else download_dir
+            
+            # Детерминированное имя: недокачанный .part продолжится при повторе или после рестарта
+            temp_filepath = attempt_dir / self._partial_filename(platform, video_id, format_spec)
+            if str(temp_filepath) in self._active_paths:
+                # Этот же файл уже качает другая загрузка - не пишем в него параллельно
+                temp_filepath = attempt_dir / self._generate_temp_filename(platform)
+            self._active_paths.add(str(temp_filepath))
+            if in_ram:
+                self._ram_reserved[str(temp_filepath)] = attempt_size
+            
+            job_opts = {
+                **self._fragment_opts(platform),
                 'format': format_spec,
                 'outtmpl': str(temp_filepath),
-                'progress_hooks': [progress_hook],
-                'noprogress': True,
+                'continuedl': True,
             }
+            started_at = time.monotonic()
+            resumed_bytes = self._partial_size(temp_filepath)
+            if resumed_bytes:
+                print(f"↩️ Resuming {temp_filepath.name} from {resumed_bytes} bytes")
             
+            job_id = uuid.uuid4().hex
+            _progress_sinks[job_id] = on_progress
             try:
-                def download():
-                    with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                        return ydl.extract_info(url, download=True)
-                
-                info = await loop.run_in_executor(None, download)
-                
-                # Проверяем, не был ли превышен размер
-                if size_exceeded:
-                    if temp_filepath.exists():
-                        temp_filepath.unlink()
-                    return None, None, None, f"Видео слишком большое! Максимальный размер: {max_server_size // (1024*1024)}MB"
-                
-                # Проверяем итоговый размер
-                if temp_filepath.exists():
-                    final_size = temp_filepath.stat().st_size
-                    if final_size > max_server_size:
-                        temp_filepath.unlink()
-                        return None, None, None, f"Видео слишком большое! Размер: {final_size // (1024*1024)}MB, лимит: {max_server_size // (1024*1024)}MB"
-                    
-                    return str(temp_filepath), info, platform, None
-                    
+                result = await self._run_in_engine(
+                    _run_download, job_id, platform, cookiefile, probed_info, job_opts, max_server_size
+                )
             except Exception as e:
-                error_msg = str(e)
-                print(f"⚠️ Download attempt failed with format {format_spec}: {error_msg}")
+                result = {'info': None, 'error': str(e), 'unrecoverable': False, 'size_exceeded': False}
+            finally:
+                _progress_sinks.pop(job_id, None)
+                self._active_paths.discard(str(temp_filepath))
+            
+            # Проверяем, не был ли превышен размер
+            if result['size_exceeded']:
+                self._discard_partial(temp_filepath)
+                return None, None, None, f"Видео слишком большое! Максимальный размер: {max_server_size // (1024*1024)}MB"
+            
+            if result['error']:
+                print(f"⚠️ Download attempt failed with format {format_spec}: {result['error']}")
+                format_stats.record(extractor, format_name, False, time.monotonic() - started_at)
+                # Ссылки из кэша могли устареть раньше срока
+                await asyncio.get_event_loop().run_in_executor(
+                    self.scheduler.executor, self.metadata_cache.invalidate, cache_key
+                )
                 
-                # Удаляем временный файл если есть
-                if temp_filepath.exists():
-                    temp_filepath.unlink()
+                # Смена формата не поможет - выходим сразу
+                if result['unrecoverable']:
+                    self._discard_partial(temp_filepath)
+                    return None, None, None, f"Видео недоступно: {self._short_error(result['error'])}"
                 
-                # Пробуем следующий формат
+                # Недокачанный файл оставляем для продолжения (кроме памяти); пробуем следующий формат
+                if in_ram:
+                    self._discard_partial(temp_filepath)
                 continue
+            
+            # Проверяем итоговый размер
+            if temp_filepath.exists():
+                final_size = temp_filepath.stat().st_size
+                if final_size > max_server_size:
+                    self._discard_partial(temp_filepath)
+                    return None, None, None, f"Видео слишком большое! Размер: {final_size // (1024*1024)}MB, лимит: {max_server_size // (1024*1024)}MB"
+                
+                elapsed = time.monotonic() - started_at
+                format_stats.record(extractor, format_name, True, elapsed)
+                self._record_throughput(platform, final_size - resumed_bytes, elapsed)
+                if in_ram:
+                    self._ram_reserved[str(temp_filepath)] = final_size
+                    self.stats['ram_staged'] += 1
+                return str(temp_filepath), result['info'], platform, None
+            
+            format_stats.record(extractor, format_name, False, time.monotonic() - started_at)
+            if in_ram:
+                self._discard_partial(temp_filepath)
         
         # Если все форматы не сработали
         return None, None, None, "Не удалось скачать видео. YouTube может блокировать запросы."
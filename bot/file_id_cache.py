@@ -0,0 +1,128 @@
+import json
+import os
+import time
+from typing import Dict, Optional
+
+from config import FILE_ID_CACHE_DB, FILE_ID_CACHE_TTL_HOURS, FILE_ID_CACHE_MAX_ENTRIES
+
+
+class FileIdCache:
+    """Persistent cache: video key -> format_id -> Telegram file_id"""
+
+    # Как часто сохранять счетчики использования (сами file_id сохраняются сразу)
+    SAVE_INTERVAL = 300
+
+    def __init__(self):
+        self._entries: Optional[Dict[str, Dict[str, dict]]] = None
+        # Есть несохраненные изменения last_used/hits
+        self._dirty = False
+        self._saved_at = time.time()
+
+    @property
+    def entries(self) -> Dict[str, Dict[str, dict]]:
+        """Cache entries, loaded from disk on first access"""
+        if self._entries is None:
+            self._entries = self._load_entries()
+        return self._entries
+
+    def _load_entries(self) -> Dict[str, Dict[str, dict]]:
+        """Load cache from JSON file"""
+        if FILE_ID_CACHE_DB.exists():
+            try:
+                with open(FILE_ID_CACHE_DB, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Error loading file_id cache: {e}")
+        return {}
+
+    def _save_entries(self):
+        """Save cache to JSON file atomically"""
+        temp_path = FILE_ID_CACHE_DB.with_name(f"{FILE_ID_CACHE_DB.name}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(self.entries, f)
+        os.replace(temp_path, FILE_ID_CACHE_DB)
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def flush(self):
+        """Save pending usage counters"""
+        if self._dirty:
+            self._save_entries()
+
+    def _cleanup(self):
+        """Remove expired entries and evict least recently used ones over the limit"""
+        expire_before = time.time() - FILE_ID_CACHE_TTL_HOURS * 3600
+
+        for video_key, formats in list(self.entries.items()):
+            for format_id, entry in list(formats.items()):
+                if entry['created_at'] < expire_before:
+                    del formats[format_id]
+            if not formats:
+                del self.entries[video_key]
+
+        all_entries = [
+            (entry['last_used'], video_key, format_id)
+            for video_key, formats in self.entries.items()
+            for format_id, entry in formats.items()
+        ]
+        overflow = len(all_entries) - FILE_ID_CACHE_MAX_ENTRIES
+        if overflow > 0:
+            all_entries.sort()
+            for _, video_key, format_id in all_entries[:overflow]:
+                del self.entries[video_key][format_id]
+                if not self.entries[video_key]:
+                    del self.entries[video_key]
+
+    def get(self, video_key: str, format_id: Optional[str] = None) -> Optional[dict]:
+        """Get cached entry for video (most recently used format if format_id is not given)"""
+        formats = self.entries.get(video_key)
+        if not formats:
+            return None
+
+        expire_before = time.time() - FILE_ID_CACHE_TTL_HOURS * 3600
+        candidates = [
+            entry for fid, entry in formats.items()
+            if entry['created_at'] >= expire_before and (format_id is None or fid == format_id)
+        ]
+        if not candidates:
+            return None
+
+        entry = max(candidates, key=lambda e: e['last_used'])
+        entry['last_used'] = time.time()
+        entry['hits'] += 1
+        # Счетчики сохраняются пачкой, а не при каждом попадании
+        self._dirty = True
+        if time.time() - self._saved_at >= self.SAVE_INTERVAL:
+            self._save_entries()
+        return entry
+
+    def put(self, video_key: str, format_id: Optional[str], file_id: str,
+            platform: str, title: Optional[str], file_size: int, duration: Optional[float] = None):
+        """Store Telegram file_id for a sent video"""
+        now = time.time()
+        self.entries.setdefault(video_key, {})[format_id or 'unknown'] = {
+            'file_id': file_id,
+            'platform': platform,
+            'title': title,
+            'file_size': file_size,
+            'duration': duration,
+            'created_at': now,
+            'last_used': now,
+            'hits': 0,
+        }
+        self._cleanup()
+        self._save_entries()
+
+    def invalidate(self, video_key: str, file_id: str):
+        """Remove entry whose file_id was rejected by Telegram"""
+        formats = self.entries.get(video_key, {})
+        for format_id, entry in list(formats.items()):
+            if entry['file_id'] == file_id:
+                del formats[format_id]
+        if video_key in self.entries and not formats:
+            del self.entries[video_key]
+        self._save_entries()
+
+
+# Singleton instance
+file_id_cache = FileIdCache()
@@ -1,5 +1,6 @@
 import hashlib
 import json
+import os
 import time
 from datetime import datetime, timedelta
 from pathlib import Path
@@ -16,7 +17,14 @@ class FileServer:
     def __init__(self):
         self.app = FastAPI(title="Video File Server")
         self._setup_routes()
-        self.links: Dict[str, dict] = self._load_links()
+        self._links: Optional[Dict[str, dict]] = None
+    
+    @property
+    def links(self) -> Dict[str, dict]:
+        """Links database, loaded from disk on first access"""
+        if self._links is None:
+            self._links = self._load_links()
+        return self._links
     
     def _load_links(self) -> Dict[str, dict]:
         """Load links from JSON file"""
@@ -26,9 +34,13 @@ class FileServer:
         return {}
     
     def _save_links(self):
-        """Save links to JSON file"""
-        with open(LINKS_DB, 'w') as f:
-            json.dump(self.links, f, indent=2)
+        """Save links to JSON file atomically"""
+        # Запись во временный файл и os.replace: при сбое links.json не остается пустым
+        data = json.dumps(self.links, indent=2)
+        temp_path = LINKS_DB.with_name(f"{LINKS_DB.name}.tmp")
+        with open(temp_path, 'w') as f:
+            f.write(data)
+        os.replace(temp_path, LINKS_DB)
     
     def _cleanup_expired_links(self):
         """Remove expired links and delete files"""
@@ -49,8 +61,9 @@ class FileServer:
         if expired_links:
             self._save_links()
     
-    def generate_link(self, filename: str, expire_minutes: int = DEFAULT_LINK_EXPIRE_MINUTES) -> str:
-        """Generate download link for file"""
+    def generate_link(self, filename: str, expire_minutes: int = DEFAULT_LINK_EXPIRE_MINUTES,
+                      faststart: bool = False) -> str:
+        """Generate download link for file (faststart: moov atom is at the front, file can be streamed)"""
         self._cleanup_expired_links()
         
         # Create unique link ID
@@ -61,7 +74,8 @@ class FileServer:
             'filename': filename,
             'created_at': time.time(),
             'expires_at': time.time() + (expire_minutes * 60),
-            'downloads': 0
+            'downloads': 0,
+            'faststart': faststart
         }
         
         self._save_links()
@@ -89,6 +103,24 @@ class FileServer:
         async def root():
             return {"status": "File server is running"}
         
+        @self.app.get("/healthz")
+        async def healthz():
+            """Liveness probe"""
+            return {"status": "ok"}
+        
+        @self.app.get("/readyz")
+        async def readyz():
+            """Readiness probe: links database loaded and storage available"""
+            try:
+                links_count = len(self.links)
+            except Exception as e:
+                return JSONResponse(status_code=503, content={"status": "error", "detail": str(e)})
+            
+            if not VIDEOS_DIR.is_dir():
+                return JSONResponse(status_code=503, content={"status": "error", "detail": "Videos directory missing"})
+            
+            return {"status": "ready", "links": links_count}
+        
         @self.app.get("/download/{link_id}")
         async def download_file(link_id: str):
             """Download file by link ID"""
@@ -102,11 +134,12 @@ class FileServer:
             if not file_path.exists():
                 raise HTTPException(status_code=404, detail="File not found")
             
-            # Return file for download
+            # faststart-файлы браузер начинает воспроизводить сразу - отдаем для просмотра
             return FileResponse(
                 path=file_path,
                 filename=file_info['filename'],
-                media_type='application/octet-stream'
+                media_type='video/mp4',
+                content_disposition_type='inline' if file_info.get('faststart') else 'attachment'
             )
         
         @self.app.get("/info/{link_id}")
@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+from config import FORMAT_STATS_DB
+
+
+class FormatStats:
+    """Persistent success/failure statistics per extractor and format spec"""
+
+    # Как часто сохранять статистику на диск (record вызывается после каждой попытки)
+    SAVE_INTERVAL = 60
+
+    def __init__(self):
+        self._stats: Optional[Dict[str, Dict[str, dict]]] = None
+        self._lock = threading.Lock()
+        # Есть несохраненные результаты попыток
+        self._dirty = False
+        self._saved_at = time.time()
+
+    @property
+    def stats(self) -> Dict[str, Dict[str, dict]]:
+        """Statistics, loaded from disk on first access"""
+        if self._stats is None:
+            self._stats = self._load_stats()
+        return self._stats
+
+    def _load_stats(self) -> Dict[str, Dict[str, dict]]:
+        """Load stats from JSON file"""
+        if FORMAT_STATS_DB.exists():
+            try:
+                with open(FORMAT_STATS_DB, 'r') as f:
+                    return json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ Error loading format stats: {e}")
+        return {}
+
+    def _save_stats(self):
+        """Save stats to JSON file atomically"""
+        temp_path = FORMAT_STATS_DB.with_name(f"{FORMAT_STATS_DB.name}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(self.stats, f, indent=2)
+        os.replace(temp_path, FORMAT_STATS_DB)
+        self._dirty = False
+        self._saved_at = time.time()
+
+    def flush(self):
+        """Save pending results"""
+        with self._lock:
+            if self._dirty:
+                self._save_stats()
+
+    def record(self, extractor: str, format_name: str, success: bool, seconds: float):
+        """Record download attempt result"""
+        with self._lock:
+            entry = self.stats.setdefault(extractor, {}).setdefault(
+                format_name, {'success': 0, 'failure': 0, 'avg_seconds': 0.0}
+            )
+            if success:
+                # Скользящее среднее времени успешной загрузки
+                entry['avg_seconds'] = (
+                    seconds if entry['success'] == 0
+                    else entry['avg_seconds'] * 0.8 + seconds * 0.2
+                )
+                entry['success'] += 1
+            else:
+                entry['failure'] += 1
+            # Сохраняем пачкой, а не после каждой попытки
+            self._dirty = True
+            if time.time() - self._saved_at >= self.SAVE_INTERVAL:
+                self._save_stats()
+
+    def order(self, extractor: str, format_names: List[str]) -> List[str]:
+        """Order format names by observed success rate, then by latency"""
+        extractor_stats = self.stats.get(extractor, {})
+
+        def score(name: str):
+            entry = extractor_stats.get(name)
+            if not entry:
+                # Нет данных - оставляем исходный порядок
+                return (0.5, 0.0)
+            total = entry['success'] + entry['failure']
+            success_rate = (entry['success'] + 1) / (total + 2)
+            return (success_rate, -entry['avg_seconds'])
+
+        # sorted стабилен: при равных оценках сохраняется исходный порядок
+        return sorted(format_names, key=score, reverse=True)
+
+
+# Singleton instance
+format_stats = FormatStats()
@@ -1,12 +1,14 @@
-﻿import os
+﻿import asyncio
+import os
 import shutil
 import time
+from contextlib import ExitStack
 from datetime import datetime
 from pathlib import Path
-from typing import Dict
+from typing import Dict, List, Optional
 from config import ADMIN_IDS
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaVideo, Message, MessageEntity
 from telegram.ext import (
     ContextTypes,
     CommandHandler,
@@ -15,18 +17,219 @@ from telegram.ext import (
     filters
 )
 
-from config import DEFAULT_MAX_CHAT_SIZE, DEFAULT_MAX_SERVER_SIZE, FILE_SERVER_URL, VIDEOS_DIR, ALLOWED_DOMAINS
+from config import DEFAULT_MAX_CHAT_SIZE, DEFAULT_MAX_SERVER_SIZE, FILE_SERVER_URL, VIDEOS_DIR, DOWNLOAD_WORKERS
+from config import TELEGRAM_LOCAL_MODE, BATCH_MAX_URLS, PROGRESS_UPDATE_INTERVAL, USER_MAX_INFLIGHT
+from bot.admission import admission
 from bot.downloader import downloader
 from bot.file_server import file_server
-from bot.utils import format_size, is_valid_url
+from bot.file_id_cache import file_id_cache
+from bot.short_links import short_link_resolver
+from bot.transcoder import transcoder
+from bot.utils import format_size, is_valid_url, route_url, extract_urls
 
 # User settings storage
-USER_SETTINGS: Dict[int, dict] = {}  # user_id -> {'max_server_size': int, 'link_expire': int}
+USER_SETTINGS: Dict[int, dict] = {}  # user_id -> {'max_server_size': int, 'link_expire': int, 'delivery_pref': str}
+
+# Лимит отправки в чат: 50MB у публичного Bot API, 2000MB у локального сервера
+CHAT_LIMIT_TEXT = f"{DEFAULT_MAX_CHAT_SIZE // (1024 * 1024)}MB"
+# Локальный сервер Bot API сам загружает большие файлы в Telegram - ждем дольше
+UPLOAD_TIMEOUT = 600 if TELEGRAM_LOCAL_MODE else 60
+
+# Видео в одном альбоме (ограничение Telegram для send_media_group)
+MEDIA_GROUP_SIZE = 10
+
+# Приоритет доставки: 'chat' - видео до лимита чата в чат, 'quality' - лучшее качество
+DELIVERY_PREF_NAMES = {
+    'chat': f'В чат (до {CHAT_LIMIT_TEXT})',
+    'quality': 'Лучшее качество',
+}
+
+# Названия платформ для подписи
+PLATFORM_NAMES = {
+    'instagram': 'Instagram 📸',
+    'youtube': 'YouTube ▶️',
+    'tiktok': 'TikTok 🎵',
+    'unknown': 'Видео 📹'
+}
+
+
+def format_progress(event: dict) -> str:
+    """Текст статуса с прогрессом загрузки"""
+    downloaded = event['downloaded_bytes']
+    total = event.get('total_bytes')
+    
+    text = "📥 *Скачиваю видео...*\n"
+    if total:
+        percent = min(downloaded / total * 100, 100)
+        filled = int(percent // 10)
+        text += f"{'▓' * filled}{'░' * (10 - filled)} {percent:.0f}%\n"
+        text += f"📏 {format_size(downloaded)} из ~{format_size(total)}\n"
+    else:
+        text += f"📏 {format_size(downloaded)}\n"
+    
+    if event.get('resumed_bytes'):
+        text += f"↩️ Продолжено с {format_size(event['resumed_bytes'])}\n"
+    
+    if event.get('speed'):
+        text += f"⚡ {format_size(int(event['speed']))}/с"
+        if event.get('eta') is not None:
+            minutes, seconds = divmod(int(event['eta']), 60)
+            text += f" • ⏳ {minutes}:{seconds:02d}"
+    return text
+
+
+def format_progress_short(event: dict) -> str:
+    """Прогресс загрузки одной строкой - для пакетного статуса"""
+    downloaded = event['downloaded_bytes']
+    total = event.get('total_bytes')
+    if total:
+        return f"📥 {min(downloaded / total * 100, 100):.0f}% из ~{format_size(total)}"
+    return f"📥 {format_size(downloaded)}"
+
+
+def _plain_line(text: str, limit: int = 60) -> str:
+    """Первая строка Markdown-текста без разметки"""
+    line = next((line for line in text.strip().splitlines() if line.strip()), '')
+    line = line.replace('*', '').replace('`', '').replace('\\', '').strip()
+    return line[:limit] + "..." if len(line) > limit else line
+
+
+class _SingleStatus:
+    """Статус одной ссылки: одно сообщение, которое создается при первом обновлении и редактируется"""
+    
+    def __init__(self, message: Message):
+        self.message = message
+        self.status_msg: Optional[Message] = None
+    
+    async def update(self, text: str, short: Optional[str] = None, reply_markup=None):
+        if self.status_msg is None:
+            self.status_msg = await self.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        else:
+            await self.status_msg.edit_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+    
+    async def fail(self, text: str):
+        await self.update(text)
+    
+    async def finish(self, text: str, reply_markup=None):
+        """Итоговое сообщение (ссылка на файл)"""
+        await self.update(text, reply_markup=reply_markup)
+    
+    async def delivered(self):
+        """Видео отправлено в чат - статус больше не нужен"""
+        if self.status_msg is not None:
+            await self.status_msg.delete()
+            self.status_msg = None
+
+
+class _BatchStatus:
+    """Общее сообщение со строкой статуса для каждой ссылки из пакета"""
+    
+    def __init__(self, message: Message, urls: List[str]):
+        self.message = message
+        self.urls = urls
+        self.lines = ["⏳ Ожидает" for _ in urls]
+        self.status_msg: Optional[Message] = None
+        self._rendered = ''
+        self._last_render = 0.0
+        self._render_task: Optional[asyncio.Task] = None
+    
+    def _text(self) -> str:
+        done = sum(line.startswith(('✅', '❌')) for line in self.lines)
+        text = f"📦 Пакетная загрузка: {done} из {len(self.urls)}\n\n"
+        for index, (url, line) in enumerate(zip(self.urls, self.lines), 1):
+            text += f"{index}. {url[:50]}\n    {line}\n"
+        return text
+    
+    async def start(self, note: str = ''):
+        # Без Markdown: в ссылках бывают символы разметки
+        self._rendered = self._text()
+        self.status_msg = await self.message.reply_text(self._rendered + note, disable_web_page_preview=True)
+    
+    def item(self, index: int) -> '_BatchItemStatus':
+        return _BatchItemStatus(self, index)
+    
+    def set_line(self, index: int, line: str):
+        self.lines[index] = line
+        # Редактируем сообщение не чаще PROGRESS_UPDATE_INTERVAL - лимиты Telegram
+        if self._render_task is None or self._render_task.done():
+            self._render_task = asyncio.ensure_future(self._render_later())
+    
+    async def _render_later(self):
+        delay = self._last_render + PROGRESS_UPDATE_INTERVAL - time.monotonic()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        await self._render()
+    
+    async def _render(self):
+        self._last_render = time.monotonic()
+        text = self._text()
+        if self.status_msg is None or text == self._rendered:
+            return
+        try:
+            await self.status_msg.edit_text(text, disable_web_page_preview=True)
+            self._rendered = text
+        except Exception as e:
+            print(f"⚠️ Batch status update failed: {e}")
+    
+    async def close(self):
+        """Final render after all items finished"""
+        if self._render_task and not self._render_task.done():
+            self._render_task.cancel()
+        await self._render()
+
+
+class _BatchItemStatus:
+    """Статус одной ссылки внутри пакета; результаты приходят отдельными сообщениями"""
+    
+    def __init__(self, batch: _BatchStatus, index: int):
+        self.batch = batch
+        self.index = index
+    
+    async def update(self, text: str, short: Optional[str] = None, reply_markup=None):
+        self.batch.set_line(self.index, short or _plain_line(text))
+    
+    async def fail(self, text: str):
+        line = _plain_line(text)
+        self.batch.set_line(self.index, line if line.startswith('❌') else f"❌ {line}")
+    
+    async def finish(self, text: str, reply_markup=None):
+        await self.batch.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        self.batch.set_line(self.index, "✅ Сохранено на сервере")
+    
+    async def delivered(self):
+        self.batch.set_line(self.index, "✅ Отправлено")
+
+
+def get_message_urls(message: Message) -> List[str]:
+    """Ссылки из сообщения (entities и текст) по порядку, без повторов"""
+    urls = []
+    for entity, text in message.parse_entities([MessageEntity.URL, MessageEntity.TEXT_LINK]).items():
+        url = entity.url if entity.type == MessageEntity.TEXT_LINK else text
+        # Telegram распознает ссылки и без схемы (youtu.be/...)
+        if '://' not in url:
+            url = f"https://{url}"
+        urls.append(url)
+    if not urls:
+        urls = extract_urls(message.text)
+    return list(dict.fromkeys(url.strip() for url in urls))
+
+
+def build_video_caption(platform: str, title: Optional[str], file_size: int) -> str:
+    """Подпись к видео, отправляемому в чат"""
+    caption = f"{PLATFORM_NAMES.get(platform, 'Видео 📹')}\n"
+    if title:
+        title = title[:100] + "..." if len(title) > 100 else title
+        safe_title = escape_markdown(title)
+        caption += f"📝 {safe_title}\n"
+
+    safe_size = escape_markdown(format_size(file_size))
+    caption += f"📊 Размер: {safe_size}"
+    return caption
 
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /start command"""
-    welcome_text = """
+    welcome_text = f"""
     🎬 *Video Downloader Bot*
     
     📥 *Поддерживаемые платформы:*
@@ -43,7 +246,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     /admin - меню администратора (только для админов)
     
     ⚠️ *Ограничения:*
-    • Видео до 50MB отправляются напрямую
+    • Видео до {CHAT_LIMIT_TEXT} отправляются напрямую
     • Большие видео сохраняются на сервере с временной ссылкой
     """
     await update.message.reply_text(welcome_text, parse_mode='Markdown')
@@ -51,7 +254,7 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Handle /help command"""
-    help_text = """
+    help_text = f"""
     📖 *Справка*
     
     *Поддерживаемые ссылки:*
@@ -69,7 +272,7 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     /admin - меню администратора
     
     *Особенности:*
-    • Большие видео (>50MB) сохраняются на сервере
+    • Большие видео (>{CHAT_LIMIT_TEXT}) сохраняются на сервере
     • Ссылки на скачивание действительны ограниченное время
     • Файлы автоматически удаляются после истечения срока
     """
@@ -97,6 +300,9 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         [
             InlineKeyboardButton("⚙️ Управление файлами", callback_data="admin_manage_files"),
             InlineKeyboardButton("📋 Общая информация", callback_data="admin_system_info"),
+        ],
+        [
+            InlineKeyboardButton("🚦 Очередь загрузок", callback_data="admin_scheduler"),
         ]
     ]
     
@@ -112,6 +318,7 @@ async def admin_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     • 🔗 Получить ссылки - получить ссылки на все видео
     • ⚙️ Управление файлами - выборочное удаление файлов
     • 📋 Общая информация - системная информация
+    • 🚦 Очередь загрузок - загрузки и лимиты пользователей
     
     Выберите действие:
     """
@@ -501,6 +708,45 @@ async def admin_system_info_callback(update: Update, context: ContextTypes.DEFAU
         for key, value in bot_info.items():
             text += f"• {key}: {value}\n"
         
+        text += "\n📐 *Выбор формата:*\n"
+        text += f"• Выборов по размеру: {downloader.stats['format_selections']}\n"
+        text += f"• Оставлено в чате (не на сервере): {downloader.stats['kept_in_chat']}\n"
+        text += f"• Загружено через память (tmpfs): {downloader.stats['ram_staged']}\n"
+        if downloader.stats['direct_url_attempts']:
+            direct_rate = downloader.stats['direct_url_sent'] / downloader.stats['direct_url_attempts']
+            text += (
+                f"• Отдано ссылкой CDN: {downloader.stats['direct_url_sent']} из "
+                f"{downloader.stats['direct_url_attempts']} ({direct_rate*100:.0f}%)\n"
+            )
+        
+        cache_stats = downloader.metadata_cache.stats()
+        text += "\n🗂️ *Кэш метаданных:*\n"
+        text += f"• Записей: {cache_stats['entries']}\n"
+        text += f"• Попаданий: {cache_stats['hits']}, промахов: {cache_stats['misses']} ({cache_stats['hit_rate']*100:.0f}%)\n"
+        text += f"• Коротких ссылок раскрыто: {short_link_resolver.misses}, из кэша: {short_link_resolver.hits}\n"
+        
+        if downloader.engine == 'process':
+            # Счетчики экземпляров ведутся в рабочих процессах
+            text += f"• Движок загрузки: процессы ({DOWNLOAD_WORKERS})\n"
+        else:
+            text += f"• Экземпляров yt-dlp: создано {downloader.ydl_pool.created}, переиспользовано {downloader.ydl_pool.reused}\n"
+        
+        if transcoder.stats['transcoded'] or transcoder.stats['failed']:
+            text += (
+                f"• Сжато для чата: {transcoder.stats['transcoded']}, неудачно: {transcoder.stats['failed']} "
+                f"({transcoder.stats['seconds']:.0f} с)\n"
+            )
+        if transcoder.stats['remuxed']:
+            text += f"• Перепаковано для потокового просмотра: {transcoder.stats['remuxed']}\n"
+        
+        if downloader.throughput:
+            text += "\n🚀 *Скорость загрузки:*\n"
+            for name, entry in downloader.throughput.items():
+                text += (
+                    f"• {name}: {format_size(int(entry['avg_bytes_per_sec']))}/с "
+                    f"({entry['downloads']} загр., {entry['concurrent_fragments']} фрагм.)\n"
+                )
+        
         text += "\n🌐 *Файловый сервер:*\n"
         text += f"• URL: {FILE_SERVER_URL}\n"
         text += f"• Статус: {'Запущен' if hasattr(file_server, 'app') else 'Остановлен'}\n"
@@ -517,6 +763,56 @@ async def admin_system_info_callback(update: Update, context: ContextTypes.DEFAU
         await query.edit_message_text(f"❌ Ошибка получения информации: {str(e)}")
 
 
+async def admin_scheduler_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Состояние очереди загрузок и лимитов пользователей"""
+    query = update.callback_query
+    await query.answer()
+    
+    user_id = query.from_user.id
+    if user_id not in ADMIN_IDS:
+        await query.edit_message_text("❌ У вас нет прав администратора!")
+        return
+    
+    queue_stats = downloader.scheduler.stats()
+    inflight = admission.inflight()
+    
+    text = "🚦 *Очередь загрузок*\n\n"
+    text += f"• Загружается: {queue_stats['running']} из {downloader.scheduler.max_workers}\n"
+    text += f"• Ожидает: {queue_stats['waiting']} (макс. {downloader.scheduler.max_queue})\n"
+    for name, count in queue_stats['running_by_platform'].items():
+        if count:
+            text += f"  - {name}: {count} из {downloader.scheduler.platform_limits.get(name, '∞')}\n"
+    
+    text += "\n👥 *Пользователи:*\n"
+    users = set(inflight) | set(queue_stats['running_by_user']) | set(queue_stats['waiting_by_user'])
+    if not users:
+        text += "• Нет активных загрузок\n"
+    for uid in sorted(users, key=str):
+        mark = " 👑" if uid in ADMIN_IDS else ""
+        text += (
+            f"• `{uid}`{mark}: ссылок {inflight.get(uid, 0)}, "
+            f"качается {queue_stats['running_by_user'].get(uid, 0)}, "
+            f"ждет {queue_stats['waiting_by_user'].get(uid, 0)}\n"
+        )
+    
+    text += "\n🛡️ *Лимиты:*\n"
+    text += f"• Ссылок одновременно: {admission.max_inflight}\n"
+    text += f"• Частота: {admission.rate_per_minute:g}/мин, подряд до {admission.burst}\n"
+    text += f"• Принято: {admission.stats['admitted']}\n"
+    text += (
+        f"• Отклонено: {admission.stats['rejected_inflight']} (одновременно), "
+        f"{admission.stats['rejected_rate']} (частота)\n"
+    )
+    
+    keyboard = [
+        [InlineKeyboardButton("🔄 Обновить", callback_data="admin_scheduler")],
+        [InlineKeyboardButton("🏠 В меню", callback_data="admin_back")],
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+
+
 async def admin_file_link_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Получить ссылку на конкретный файл"""
     query = update.callback_query
@@ -683,6 +979,9 @@ async def admin_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
         [
             InlineKeyboardButton("⚙️ Управление файлами", callback_data="admin_manage_files"),
             InlineKeyboardButton("📋 Общая информация", callback_data="admin_system_info"),
+        ],
+        [
+            InlineKeyboardButton("🚦 Очередь загрузок", callback_data="admin_scheduler"),
         ]
     ]
     
@@ -698,6 +997,7 @@ async def admin_back_callback(update: Update, context: ContextTypes.DEFAULT_TYPE
     • 🔗 Получить ссылки - получить ссылки на все видео
     • ⚙️ Управление файлами - выборочное удаление файлов
     • 📋 Общая информация - системная информация
+    • 🚦 Очередь загрузок - загрузки и лимиты пользователей
     
     Выберите действие:
     """
@@ -712,12 +1012,16 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     current_server_size = user_settings.get('max_server_size', DEFAULT_MAX_SERVER_SIZE)
     current_expire = user_settings.get('link_expire', 60)
+    current_delivery = user_settings.get('delivery_pref', 'chat')
     
     keyboard = [
         [
             InlineKeyboardButton("Лимит сервера", callback_data="menu_server_size"),
             InlineKeyboardButton("Время ссылок", callback_data="menu_expire"),
         ],
+        [
+            InlineKeyboardButton("Приоритет доставки", callback_data="menu_delivery"),
+        ],
         [
             InlineKeyboardButton("Текущие настройки", callback_data="show_current"),
             InlineKeyboardButton("Сбросить", callback_data="reset_settings"),
@@ -730,10 +1034,11 @@ async def settings(update: Update, context: ContextTypes.DEFAULT_TYPE):
         f"⚙️ *Настройки*\n\n"
         f"*Текущие значения:*\n"
         f"• Макс. размер для сервера: {format_size(current_server_size)}\n"
-        f"• Время жизни ссылок: {current_expire} мин.\n\n"
+        f"• Время жизни ссылок: {current_expire} мин.\n"
+        f"• Приоритет доставки: {DELIVERY_PREF_NAMES[current_delivery]}\n\n"
         f"*Примечания:*\n"
-        f"• Видео ≤50MB отправляются в чат\n"
-        f"• Видео >50MB сохраняются на сервер\n"
+        f"• Видео ≤{CHAT_LIMIT_TEXT} отправляются в чат\n"
+        f"• Видео >{CHAT_LIMIT_TEXT} сохраняются на сервер\n"
         f"• Если видео превышает лимит сервера, загрузка прерывается\n\n"
         f"Выберите категорию для настройки:"
     )
@@ -753,6 +1058,8 @@ async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await show_server_size_menu(query)
     elif data == "menu_expire":
         await show_expire_menu(query)
+    elif data == "menu_delivery":
+        await show_delivery_menu(query)
     elif data == "show_current":
         await show_current_settings(query)
     elif data == "reset_settings":
@@ -761,6 +1068,8 @@ async def settings_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await set_server_size(query, data)
     elif data.startswith("expire_"):
         await set_expire(query, data)
+    elif data.startswith("delivery_"):
+        await set_delivery(query, data)
     elif data == "back_to_menu":
         await settings_edit(query)
 
@@ -788,7 +1097,7 @@ async def show_server_size_menu(query):
     await query.edit_message_text(
         "📏 *Выберите максимальный размер видео для сервера:*\n\n"
         "Если видео превысит этот размер во время загрузки, загрузка будет прервана.\n"
-        "Видео до 50MB отправляются в чат, видео больше 50MB сохраняются на сервере.",
+        f"Видео до {CHAT_LIMIT_TEXT} отправляются в чат, видео больше {CHAT_LIMIT_TEXT} сохраняются на сервере.",
         parse_mode='Markdown',
         reply_markup=reply_markup
     )
@@ -830,6 +1139,7 @@ async def show_current_settings(query):
     
     current_server_size = user_settings.get('max_server_size', DEFAULT_MAX_SERVER_SIZE)
     current_expire = user_settings.get('link_expire', 60)
+    current_delivery = user_settings.get('delivery_pref', 'chat')
     
     keyboard = [[InlineKeyboardButton("Назад", callback_data="back_to_menu")]]
     reply_markup = InlineKeyboardMarkup(keyboard)
@@ -845,9 +1155,12 @@ async def show_current_settings(query):
     • Ссылки действительны: {current_expire} минут
     • После истечения времени файлы удаляются автоматически
     
+    *Приоритет доставки:*
+    • {DELIVERY_PREF_NAMES[current_delivery]}
+    
     *Примечание:*
-    • Видео до 50MB отправляются в чат Telegram
-    • Видео от 50MB до лимита сервера сохраняются на сервере
+    • Видео до {CHAT_LIMIT_TEXT} отправляются в чат Telegram
+    • Видео от {CHAT_LIMIT_TEXT} до лимита сервера сохраняются на сервере
     
     *Сервер:*
     • Файлы хранятся на: {FILE_SERVER_URL}
@@ -913,6 +1226,49 @@ async def set_expire(query, data):
     )
 
 
+async def show_delivery_menu(query):
+    """Show delivery preference menu"""
+    keyboard = [
+        [
+            InlineKeyboardButton(DELIVERY_PREF_NAMES['chat'], callback_data="delivery_chat"),
+            InlineKeyboardButton(DELIVERY_PREF_NAMES['quality'], callback_data="delivery_quality"),
+        ],
+        [
+            InlineKeyboardButton("Назад", callback_data="back_to_menu"),
+        ]
+    ]
+    
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        "📤 *Выберите приоритет доставки:*\n\n"
+        f"• В чат - если есть версия видео до {CHAT_LIMIT_TEXT}, бот выберет ее и отправит прямо в чат\n"
+        "• Лучшее качество - бот скачает лучшую версию, большие видео придут ссылкой на сервер",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+
+async def set_delivery(query, data):
+    """Set delivery preference"""
+    user_id = query.from_user.id
+    delivery_pref = data.split("_")[1]
+    
+    if user_id not in USER_SETTINGS:
+        USER_SETTINGS[user_id] = {}
+    
+    USER_SETTINGS[user_id]['delivery_pref'] = delivery_pref
+    
+    keyboard = [[InlineKeyboardButton("Назад", callback_data="back_to_menu")]]
+    reply_markup = InlineKeyboardMarkup(keyboard)
+    
+    await query.edit_message_text(
+        f"✅ Приоритет доставки установлен: *{DELIVERY_PREF_NAMES[delivery_pref]}*",
+        parse_mode='Markdown',
+        reply_markup=reply_markup
+    )
+
+
 async def settings_edit(query):
     """Edit settings message"""
     user_id = query.from_user.id
@@ -920,12 +1276,16 @@ async def settings_edit(query):
     
     current_server_size = user_settings.get('max_server_size', DEFAULT_MAX_SERVER_SIZE)
     current_expire = user_settings.get('link_expire', 60)
+    current_delivery = user_settings.get('delivery_pref', 'chat')
     
     keyboard = [
         [
             InlineKeyboardButton("Лимит сервера", callback_data="menu_server_size"),
             InlineKeyboardButton("Время ссылок", callback_data="menu_expire"),
         ],
+        [
+            InlineKeyboardButton("Приоритет доставки", callback_data="menu_delivery"),
+        ],
         [
             InlineKeyboardButton("Текущие настройки", callback_data="show_current"),
             InlineKeyboardButton("Сбросить", callback_data="reset_settings"),
@@ -940,6 +1300,7 @@ async def settings_edit(query):
     *Текущие значения:*
     • Макс. размер для сервера: {format_size(current_server_size)}
     • Время жизни ссылок: {current_expire} мин.
+    • Приоритет доставки: {DELIVERY_PREF_NAMES[current_delivery]}
     
     Выберите категорию для настройки:
     """
@@ -948,12 +1309,11 @@ async def settings_edit(query):
 
 
 async def handle_video_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Handle video URL message - НОВАЯ ЛОГИКА"""
-    url = update.message.text.strip()
-    user_id = update.effective_user.id
+    """Handle message with one or several video URLs"""
+    urls = [url for url in get_message_urls(update.message) if is_valid_url(url)]
     
     # Validate URL
-    if not is_valid_url(url):
+    if not urls:
         await update.message.reply_text(
             "❌ *Неверная ссылка*\n\n"
             "Пожалуйста, отправьте корректную ссылку на видео из:\n"
@@ -962,79 +1322,210 @@ async def handle_video_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
         )
         return
     
-    # Check if domain is allowed
-    if not any(domain in url.lower() for domain in ALLOWED_DOMAINS):
-        await update.message.reply_text(
+    if len(urls) == 1:
+        await process_video_url(update, context, urls[0], _SingleStatus(update.message))
+        return
+    
+    note = ''
+    if len(urls) > BATCH_MAX_URLS:
+        note = f"\n⚠️ Обработаю первые {BATCH_MAX_URLS} ссылок из {len(urls)}"
+        urls = urls[:BATCH_MAX_URLS]
+    
+    batch = _BatchStatus(update.message, urls)
+    await batch.start(note)
+    
+    # Каждая ссылка - отдельная задача; параллельность ограничивает очередь загрузчика
+    # и лимит пользователя, результаты отправляются по мере готовности
+    user_slots = asyncio.Semaphore(USER_MAX_INFLIGHT)
+    
+    async def process_item(index: int, url: str):
+        async with user_slots:
+            await process_video_url(update, context, url, batch.item(index))
+    
+    results = await asyncio.gather(*(
+        process_item(index, url) for index, url in enumerate(urls)
+    ), return_exceptions=True)
+    for index, result in enumerate(results):
+        if isinstance(result, Exception):
+            print(f"Error processing video: {result}")
+            await batch.item(index).fail(f"❌ Ошибка: {result}")
+    await batch.close()
+
+
+async def process_video_url(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, status):
+    """
+    Route check and admission control, then download and deliver one video
+    
+    status reports progress and results: a single status message or a line of a batch.
+    """
+    user_id = update.effective_user.id
+    
+    # Check if domain is allowed (до лимитов: чужие ссылки не расходуют квоту пользователя)
+    if route_url(url) is None:
+        await status.fail(
             "❌ *Платформа не поддерживается*\n\n"
             "Поддерживаемые платформы:\n"
             "• Instagram (instagram.com)\n"
             "• YouTube (youtube.com, youtu.be)\n"
-            "• TikTok (tiktok.com, vm.tiktok.com)",
-            parse_mode='Markdown'
+            "• TikTok (tiktok.com, vm.tiktok.com)"
         )
         return
     
+    # Дешевый отказ до любой работы yt-dlp
+    rejection = admission.try_acquire(user_id)
+    if rejection:
+        await status.fail(f"⏳ {rejection}")
+        return
+    
+    try:
+        await _process_admitted_url(update, context, url, status)
+    finally:
+        admission.release(user_id)
+
+
+async def _process_admitted_url(update: Update, context: ContextTypes.DEFAULT_TYPE, url: str, status):
+    """Download and deliver one video"""
+    user_id = update.effective_user.id
+    
     # Get user settings
     user_settings = USER_SETTINGS.get(user_id, {})
     max_server_size = user_settings.get('max_server_size', DEFAULT_MAX_SERVER_SIZE)
     link_expire = user_settings.get('link_expire', 60)
+    prefer_chat = user_settings.get('delivery_pref', 'chat') == 'chat'
+    
+    # Короткие ссылки раскрываем заранее, чтобы кэши и дедупликация видели id видео
+    url = await short_link_resolver.resolve(url)
+    
+    # Видео уже отправлялось - пересылаем по file_id без скачивания.
+    # Ключ учитывает предпочтение: выбравшему качество не отдаем сжатую для чата копию
+    video_key = f"{downloader.get_video_key(url)}|{'chat' if prefer_chat else 'quality'}"
+    cached = file_id_cache.get(video_key)
+    if cached:
+        try:
+            await update.message.reply_video(
+                video=cached['file_id'],
+                caption=build_video_caption(cached['platform'], cached['title'], cached['file_size']),
+                supports_streaming=True
+            )
+            await status.delivered()
+            return
+        except Exception as e:
+            print(f"⚠️ Cached file_id rejected for {video_key}: {e}")
+            file_id_cache.invalidate(video_key, cached['file_id'])
     
     # Send status message
-    status_msg = await update.message.reply_text(
+    await status.update(
         "🔍 *Анализирую ссылку...*\n"
-        f"⚠️ Лимит сервера: {format_size(max_server_size)}",
-        parse_mode='Markdown'
+        f"⚠️ Лимит сервера: {format_size(max_server_size)}"
     )
     
+    downloading_text = (
+        "📥 *Скачиваю видео...*\n"
+        f"⏳ Проверяю размер (макс. {max_server_size // (1024*1024)}MB)..."
+    )
+    
+    download_done = False
+    position_shown_at = 0.0
+    
+    async def on_status(event: dict):
+        """Показывает позицию в очереди и прогресс загрузки"""
+        nonlocal position_shown_at
+        # Запоздавшие события не должны затирать итоговый статус
+        if download_done:
+            return
+        short = None
+        if event['status'] == 'queued':
+            if event['position'] > 0:
+                # Каждый запуск из очереди сдвигает всех ожидающих - редактируем
+                # не чаще PROGRESS_UPDATE_INTERVAL, иначе Telegram ответит 429
+                now = time.monotonic()
+                if now - position_shown_at < PROGRESS_UPDATE_INTERVAL:
+                    return
+                position_shown_at = now
+                text = (
+                    f"⏳ *Вы #{event['position']} в очереди*\n"
+                    "Загрузка начнется автоматически."
+                )
+                short = f"⏳ #{event['position']} в очереди"
+            else:
+                text = downloading_text
+        elif event['status'] == 'downloading':
+            text = format_progress(event)
+            short = format_progress_short(event)
+        else:
+            return
+        await status.update(text, short)
+    
     try:
         # Скачиваем с проверкой размера
-        await status_msg.edit_text(
-            "📥 *Скачиваю видео...*\n"
-            f"⏳ Проверяю размер (макс. {max_server_size // (1024*1024)}MB)...",
-            parse_mode='Markdown'
-        )
+        await status.update(downloading_text)
         
+        # Небольшой progressive mp4 Telegram заберет сам с CDN - без нашей загрузки
         temp_filepath, info, platform, error = await downloader.download_with_size_check(
-            url, max_server_size
+            url, max_server_size, on_status, prefer_chat, user_id, allow_direct=True
         )
+        if info and info.get('_type') == 'direct_url':
+            if await deliver_direct_url(update, video_key, info, status):
+                download_done = True
+                return
+            # Telegram не смог скачать ссылку - качаем сами (метаданные уже в кэше)
+            temp_filepath, info, platform, error = await downloader.download_with_size_check(
+                url, max_server_size, on_status, prefer_chat, user_id
+            )
+        download_done = True
         
         if error:
-            await status_msg.edit_text(
+            await status.fail(
                 f"❌ *Ошибка:* {error}\n\n"
-                "Попробуйте уменьшить лимит в /settings или выберите другое видео.",
-                parse_mode='Markdown'
+                "Попробуйте уменьшить лимит в /settings или выберите другое видео."
             )
             return
         
         if not temp_filepath or not info:
-            await status_msg.edit_text(
+            await status.fail(
                 "❌ Не удалось скачать видео.\n"
-                "Возможно, видео приватное или платформа заблокировала запрос.",
-                parse_mode='Markdown'
+                "Возможно, видео приватное или платформа заблокировала запрос."
             )
             return
         
+        # Карусель из нескольких видео - отправляем альбомом
+        if info.get('_type') == 'playlist':
+            temp_filepath = None
+            await deliver_media_group(update, context, info, platform, status, link_expire)
+            return
+        
         # Получаем реальный размер файла
         file_size = Path(temp_filepath).stat().st_size
+        format_id = info.get('format_id')
         
-        # Определяем платформу для подписи
-        platform_names = {
-            'instagram': 'Instagram 📸',
-            'youtube': 'YouTube ▶️',
-            'tiktok': 'TikTok 🎵',
-            'unknown': 'Видео 📹'
-        }
+        # Чуть больше лимита чата - пробуем сжать, чтобы видео ушло в Telegram
+        video_bitrate = (
+            transcoder.target_video_bitrate(file_size, info.get('duration'), DEFAULT_MAX_CHAT_SIZE)
+            if prefer_chat else None
+        )
+        if video_bitrate:
+            await status.update(
+                "🗜️ *Сжимаю видео для отправки в чат...*\n"
+                f"📏 {format_size(file_size)} → до {format_size(DEFAULT_MAX_CHAT_SIZE)}"
+            )
+            # Ссылка на исходный файл переходит на сжатую копию
+            transcoded_filepath = await downloader.shrink_file(temp_filepath, video_bitrate, DEFAULT_MAX_CHAT_SIZE)
+            if transcoded_filepath:
+                temp_filepath = transcoded_filepath
+                file_size = Path(temp_filepath).stat().st_size
+                format_id = f"{format_id}-transcoded"
         
-        platform_display = platform_names.get(platform, 'Видео 📹')
+        # Определяем платформу для подписи
+        platform_display = PLATFORM_NAMES.get(platform, 'Видео 📹')
         
         # РЕШАЕМ: отправлять в чат или на сервер
         if file_size <= DEFAULT_MAX_CHAT_SIZE:
             # Отправляем в чат Telegram
-            await status_msg.edit_text(
+            await status.update(
                 "✅ *Видео скачано!*\n"
                 f"📏 Размер: {format_size(file_size)}\n"
                 "📤 Отправляю в Telegram...",
-                parse_mode='Markdown'
+                "📤 Отправляю в Telegram..."
             )
             
             await context.bot.send_chat_action(
@@ -1043,62 +1534,76 @@ async def handle_video_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             
             # Создаем подпись
-            caption = f"{platform_display}\n"
-            if info.get('title'):
-                title = info['title'][:100] + "..." if len(info['title']) > 100 else info['title']
-                safe_title = escape_markdown(title)
-                caption += f"📝 {safe_title}\n"
-
-            safe_size = escape_markdown(format_size(file_size))
-            caption += f"📊 Размер: {safe_size}"
+            caption = build_video_caption(platform, info.get('title'), file_size)
             # Отправляем видео
             try:
-                with open(temp_filepath, 'rb') as video_file:
-                    await update.message.reply_video(
-                        video=video_file,
+                if TELEGRAM_LOCAL_MODE:
+                    # Локальный сервер Bot API читает файл по пути - байты не идут через HTTP
+                    sent_message = await update.message.reply_video(
+                        video=Path(temp_filepath),
                         caption=caption,
                         supports_streaming=True,
-                        read_timeout=60,
+                        read_timeout=UPLOAD_TIMEOUT,
                         write_timeout=60,
                         connect_timeout=60
                     )
+                else:
+                    with open(temp_filepath, 'rb') as video_file:
+                        sent_message = await update.message.reply_video(
+                            video=video_file,
+                            caption=caption,
+                            supports_streaming=True,
+                            read_timeout=UPLOAD_TIMEOUT,
+                            write_timeout=60,
+                            connect_timeout=60
+                        )
+                
+                # Запоминаем file_id для повторных запросов
+                if sent_message.video:
+                    file_id_cache.put(
+                        video_key, format_id, sent_message.video.file_id,
+                        platform, info.get('title'), file_size, info.get('duration')
+                    )
                 
-                # Удаляем временный файл
-                Path(temp_filepath).unlink()
+                # Освобождаем временный файл
+                downloader.release_file(temp_filepath)
+                temp_filepath = None
                 
-                await status_msg.delete()
+                await status.delivered()
                 
             except Exception as e:
-                await status_msg.edit_text(
+                await status.fail(
                     f"❌ *Ошибка отправки в Telegram:*\n`{str(e)[:200]}`\n\n"
-                    "Попробуйте еще раз.",
-                    parse_mode='Markdown'
+                    "Попробуйте еще раз."
                 )
-                if Path(temp_filepath).exists():
-                    Path(temp_filepath).unlink()
+                if temp_filepath:
+                    downloader.release_file(temp_filepath)
                 return
                 
         else:
             # Сохраняем на сервере и отправляем ссылку
-            await status_msg.edit_text(
+            await status.update(
                 f"✅ *Видео скачано!*\n"
                 f"📏 Размер: {format_size(file_size)}\n"
                 f"💾 Сохраняю на сервер...",
-                parse_mode='Markdown'
+                "💾 Сохраняю на сервер..."
             )
             
             # Перемещаем файл в постоянное хранилище
             try:
-                final_filename = downloader.move_to_server_storage(temp_filepath, platform)
+                # Индекс в начало файла - видео по ссылке начнет играть сразу
+                faststart = await transcoder.make_faststart(temp_filepath)
+                final_filename = await downloader.move_to_server_storage(temp_filepath, platform)
+                temp_filepath = None
                 final_filepath = VIDEOS_DIR / final_filename
                 
                 # Проверяем, что файл существует
                 if not final_filepath.exists():
-                    await status_msg.edit_text("❌ Ошибка при сохранении файла на сервер")
+                    await status.fail("❌ Ошибка при сохранении файла на сервер")
                     return
                 
                 # Генерируем ссылку
-                download_link = file_server.generate_link(final_filename, link_expire)
+                download_link = file_server.generate_link(final_filename, link_expire, faststart)
                 full_url = f"{FILE_SERVER_URL}{download_link}"
                 
                 # Создаем клавиатуру с кнопкой
@@ -1126,33 +1631,124 @@ async def handle_video_url(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     safe_title = escape_markdown(title)
                     message_text = f"📝 *{safe_title}*\n\n" + message_text
                 
-                await status_msg.edit_text(
-                    message_text, 
-                    parse_mode='Markdown', 
-                    reply_markup=reply_markup
-                )
+                await status.finish(message_text, reply_markup)
                 
             except Exception as e:
-                await status_msg.edit_text(
-                    f"❌ *Ошибка при сохранении на сервере:*\n`{str(e)[:200]}`",
-                    parse_mode='Markdown'
+                await status.fail(
+                    f"❌ *Ошибка при сохранении на сервере:*\n`{str(e)[:200]}`"
                 )
-                # Удаляем временный файл, если он еще существует
-                if Path(temp_filepath).exists():
-                    Path(temp_filepath).unlink()
+                # Освобождаем временный файл, если он еще существует
+                if temp_filepath:
+                    downloader.release_file(temp_filepath)
                 return
     
     except Exception as e:
         print(f"Error processing video: {e}")
-        await status_msg.edit_text(
+        await status.fail(
             f"❌ *Критическая ошибка обработки видео*\n\n"
             f"Техническая информация:\n`{str(e)[:200]}`\n\n"
-            f"Пожалуйста, попробуйте еще раз или обратитесь к администратору.",
-            parse_mode='Markdown'
+            f"Пожалуйста, попробуйте еще раз или обратитесь к администратору."
         )
-        # Удаляем временный файл, если он существует
-        if 'temp_filepath' in locals() and temp_filepath and Path(temp_filepath).exists():
-            Path(temp_filepath).unlink()
+        # Освобождаем временный файл, если он существует
+        if 'temp_filepath' in locals() and temp_filepath:
+            downloader.release_file(temp_filepath)
+
+
+async def deliver_direct_url(update: Update, video_key: str, direct: dict, status) -> bool:
+    """Send video by its CDN URL; False if Telegram could not fetch it"""
+    downloader.stats['direct_url_attempts'] += 1
+    try:
+        sent_message = await update.message.reply_video(
+            video=direct['url'],
+            caption=build_video_caption(direct['platform'], direct['title'], direct['size']),
+            supports_streaming=True
+        )
+    except Exception as e:
+        print(f"⚠️ Direct URL rejected for {video_key}: {e}")
+        return False
+    
+    downloader.stats['direct_url_sent'] += 1
+    if sent_message.video:
+        file_id_cache.put(
+            video_key, direct['format_id'], sent_message.video.file_id,
+            direct['platform'], direct['title'], sent_message.video.file_size or direct['size'],
+            direct['duration']
+        )
+    await status.delivered()
+    return True
+
+
+async def deliver_media_group(update: Update, context: ContextTypes.DEFAULT_TYPE, info: dict,
+                              platform: str, status, link_expire: int):
+    """
+    Send playlist entries as albums of up to MEDIA_GROUP_SIZE videos
+    
+    Entries over the chat limit are stored on the file server and sent as links.
+    Releases every entry file.
+    """
+    entries = info['entries']
+    sizes = [Path(entry['filepath']).stat().st_size for entry in entries]
+    chat_entries = [entry for entry, size in zip(entries, sizes) if size <= DEFAULT_MAX_CHAT_SIZE]
+    server_entries = [entry for entry, size in zip(entries, sizes) if size > DEFAULT_MAX_CHAT_SIZE]
+    
+    try:
+        await status.update(
+            f"✅ *Скачано видео: {len(entries)}*\n"
+            f"📏 Размер: {format_size(sum(sizes))}\n"
+            "📤 Отправляю в Telegram...",
+            "📤 Отправляю альбом..."
+        )
+        await context.bot.send_chat_action(chat_id=update.effective_chat.id, action='upload_video')
+        
+        caption = build_video_caption(platform, info.get('title'), sum(sizes))
+        for start in range(0, len(chat_entries), MEDIA_GROUP_SIZE):
+            chunk = chat_entries[start:start + MEDIA_GROUP_SIZE]
+            with ExitStack() as stack:
+                videos = [
+                    # Локальный сервер Bot API читает файлы по пути
+                    Path(entry['filepath']) if TELEGRAM_LOCAL_MODE
+                    else stack.enter_context(open(entry['filepath'], 'rb'))
+                    for entry in chunk
+                ]
+                chunk_caption = caption if start == 0 else None
+                if len(videos) == 1:
+                    # Альбом должен содержать минимум два элемента
+                    await update.message.reply_video(
+                        video=videos[0], caption=chunk_caption, supports_streaming=True,
+                        read_timeout=UPLOAD_TIMEOUT, write_timeout=60, connect_timeout=60
+                    )
+                else:
+                    await update.message.reply_media_group(
+                        media=[
+                            InputMediaVideo(video, caption=chunk_caption if i == 0 else None, supports_streaming=True)
+                            for i, video in enumerate(videos)
+                        ],
+                        read_timeout=UPLOAD_TIMEOUT, write_timeout=60, connect_timeout=60
+                    )
+            for entry in chunk:
+                downloader.release_file(entry['filepath'])
+                entry['filepath'] = None
+        
+        links = []
+        for entry in server_entries:
+            faststart = await transcoder.make_faststart(entry['filepath'])
+            final_filename = await downloader.move_to_server_storage(entry['filepath'], platform)
+            entry['filepath'] = None
+            download_link = file_server.generate_link(final_filename, link_expire, faststart)
+            links.append(f"{FILE_SERVER_URL}{download_link}")
+        
+        if links:
+            await status.finish(
+                f"✅ *Видео больше {CHAT_LIMIT_TEXT} сохранены на сервере:*\n\n"
+                + "\n".join(f"🔗 `{escape_markdown(link)}`" for link in links)
+                + f"\n\n⚠️ *Ссылки действительны {link_expire} минут*"
+            )
+        else:
+            await status.delivered()
+    finally:
+        for entry in entries:
+            if entry.get('filepath'):
+                downloader.release_file(entry['filepath'])
 
 
 async def link_info_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1240,7 +1836,7 @@ def setup_handlers(application):
     application.add_handler(CommandHandler("cleanup", cleanup_command))
     
     # Callback query handlers для настроек
-    application.add_handler(CallbackQueryHandler(settings_callback, pattern="^(menu_|show_|reset_|server_size_|expire_|back_to_menu)"))
+    application.add_handler(CallbackQueryHandler(settings_callback, pattern="^(menu_|show_|reset_|server_size_|expire_|delivery_|back_to_menu)"))
     application.add_handler(CallbackQueryHandler(link_info_callback, pattern="^link_info_"))
     
     # Callback query handlers для админки
@@ -1250,10 +1846,12 @@ def setup_handlers(application):
     application.add_handler(CallbackQueryHandler(admin_get_links_callback, pattern="^admin_get_links$"))
     application.add_handler(CallbackQueryHandler(admin_manage_files_callback, pattern="^admin_manage_files$"))
     application.add_handler(CallbackQueryHandler(admin_system_info_callback, pattern="^admin_system_info$"))
+    application.add_handler(CallbackQueryHandler(admin_scheduler_callback, pattern="^admin_scheduler$"))
     application.add_handler(CallbackQueryHandler(admin_file_link_callback, pattern="^admin_file_link_"))
     application.add_handler(CallbackQueryHandler(admin_file_delete_callback, pattern="^admin_file_delete_"))
     application.add_handler(CallbackQueryHandler(admin_file_nav_callback, pattern="^(admin_file_prev|admin_file_next)$"))
     application.add_handler(CallbackQueryHandler(admin_back_callback, pattern="^admin_back$"))
     
     # Message handlers
-    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_video_url))
\ No newline at end of file
+    # block=False: ссылки разных пользователей обрабатываются параллельно, порядок задает очередь загрузок
+    application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_video_url, block=False))
\ No newline at end of file
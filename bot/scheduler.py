@@ -0,0 +1,166 @@
+import asyncio
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from typing import Awaitable, Callable, Dict, Hashable, List, Optional
+
+
+class QueueFullError(Exception):
+    """Raised when the download queue has no free places"""
+
+
+class _Job:
+    """Задача в очереди загрузок"""
+
+    def __init__(self, platform: str, user_id: Hashable, weight: float, seq: int):
+        self.platform = platform
+        self.user_id = user_id
+        self.weight = weight
+        self.seq = seq
+        self.started = False
+        self.changed = asyncio.Event()
+
+
+class DownloadScheduler:
+    """
+    Bounded download queue with global and per-platform worker limits
+
+    Waiting jobs are started in weighted fair order: users take turns in proportion
+    to their weights instead of first come, first served.
+    """
+
+    def __init__(self, max_workers: int, platform_limits: Dict[str, int], max_queue: int):
+        self.max_workers = max_workers
+        self.platform_limits = platform_limits
+        self.max_queue = max_queue
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='download')
+
+        self._waiting: List[_Job] = []
+        self._running: Dict[str, int] = {}
+        self._running_total = 0
+        self._running_by_user: Dict[Hashable, int] = {}
+        # Виртуальное время пользователя: сколько слотов он получил, деленное на вес
+        self._served: Dict[Hashable, float] = {}
+        self._seq = itertools.count()
+
+    def _can_start(self, platform: str) -> bool:
+        """Check global and platform limits"""
+        if self._running_total >= self.max_workers:
+            return False
+        limit = self.platform_limits.get(platform, self.max_workers)
+        return self._running.get(platform, 0) < limit
+
+    def _ordered_waiting(self) -> List[_Job]:
+        """Waiting jobs in start order (weighted fair queueing by user)"""
+        tagged = []
+        queued: Dict[Hashable, int] = {}
+        for job in self._waiting:
+            # k-я задача пользователя начнется, когда его время дойдет до served + k / weight
+            queued[job.user_id] = queued.get(job.user_id, 0) + 1
+            tag = self._served.get(job.user_id, 0.0) + queued[job.user_id] / job.weight
+            tagged.append((tag, job.seq, job))
+        tagged.sort(key=lambda item: (item[0], item[1]))
+        return [job for _, _, job in tagged]
+
+    def _active_users(self) -> set:
+        """Users with running or waiting jobs"""
+        return set(self._running_by_user) | {job.user_id for job in self._waiting}
+
+    def _dispatch(self):
+        """Start waiting jobs while there are free slots"""
+        started = []
+        for job in self._ordered_waiting():
+            if self._running_total >= self.max_workers:
+                break
+            # Задачи заблокированной платформы не задерживают остальные
+            if not self._can_start(job.platform):
+                continue
+            self._waiting.remove(job)
+            job.started = True
+            self._running[job.platform] = self._running.get(job.platform, 0) + 1
+            self._running_total += 1
+            self._running_by_user[job.user_id] = self._running_by_user.get(job.user_id, 0) + 1
+            self._served[job.user_id] = self._served.get(job.user_id, 0.0) + 1 / job.weight
+            started.append(job)
+
+        # Позиции в очереди могли измениться у всех ожидающих
+        for job in started + self._waiting:
+            job.changed.set()
+
+    def _finish(self, job: _Job):
+        """Release job slot"""
+        self._running[job.platform] -= 1
+        self._running_total -= 1
+        self._running_by_user[job.user_id] -= 1
+        if not self._running_by_user[job.user_id]:
+            del self._running_by_user[job.user_id]
+        if not self._running_total and not self._waiting:
+            # Очередь пуста - прошлые заслуги больше не важны
+            self._served.clear()
+        self._dispatch()
+
+    def queue_position(self, job: _Job) -> int:
+        """1-based position in queue, 0 if job is already running"""
+        if job.started:
+            return 0
+        return self._ordered_waiting().index(job) + 1
+
+    def stats(self) -> dict:
+        """Current queue state"""
+        return {
+            'running': self._running_total,
+            'waiting': len(self._waiting),
+            'running_by_platform': dict(self._running),
+            'running_by_user': dict(self._running_by_user),
+            'waiting_by_user': {
+                user_id: sum(1 for job in self._waiting if job.user_id == user_id)
+                for user_id in {job.user_id for job in self._waiting}
+            },
+        }
+
+    @asynccontextmanager
+    async def slot(self, platform: str,
+                   on_position: Optional[Callable[[int], Awaitable[None]]] = None,
+                   user_id: Hashable = None, weight: float = 1.0):
+        """
+        Wait for a free download slot
+
+        on_position is awaited every time the queue position changes (0 = started).
+        Users with higher weight get proportionally more slots while others wait.
+        Raises QueueFullError if the queue is full.
+        """
+        if len(self._waiting) >= self.max_queue:
+            raise QueueFullError(f"Download queue is full ({self.max_queue})")
+
+        active = self._active_users()
+        if user_id not in active and active:
+            # Вернувшийся после простоя пользователь встает наравне с активными, а не впереди всех
+            self._served[user_id] = max(
+                self._served.get(user_id, 0.0), min(self._served.get(u, 0.0) for u in active)
+            )
+
+        job = _Job(platform, user_id, weight, next(self._seq))
+        self._waiting.append(job)
+        self._dispatch()
+
+        try:
+            last_position = None
+            while not job.started:
+                job.changed.clear()
+                position = self.queue_position(job)
+                if on_position and position != last_position:
+                    last_position = position
+                    await on_position(position)
+                if not job.started:
+                    await job.changed.wait()
+
+            if on_position and last_position:
+                await on_position(0)
+
+            yield
+        finally:
+            if job.started:
+                self._finish(job)
+            else:
+                self._waiting.remove(job)
+                self._dispatch()
@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+from config import SHORT_LINK_CACHE_SIZE, SHORT_LINK_TIMEOUT
+from bot.utils import is_short_link, route_url
+
+
+class ShortLinkResolver:
+    """Resolve short links to canonical video URLs over a shared keep-alive connection pool"""
+
+    MAX_REDIRECTS = 5
+    USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+    def __init__(self, cache_size: int = SHORT_LINK_CACHE_SIZE):
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+        self._cache: "OrderedDict[str, str]" = OrderedDict()
+        self._session = None
+
+    def _get_session(self):
+        """Shared aiohttp session (created on first use inside the event loop)"""
+        if self._session is None or self._session.closed:
+            import aiohttp
+
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=20, ttl_dns_cache=300, keepalive_timeout=60),
+                timeout=aiohttp.ClientTimeout(total=SHORT_LINK_TIMEOUT),
+                headers={'User-Agent': self.USER_AGENT},
+            )
+        return self._session
+
+    async def resolve(self, url: str) -> str:
+        """
+        Follow redirects of a short link until the video id is visible
+
+        Returns canonical URL, or the original URL if it is not a short link
+        or could not be resolved (yt-dlp will then follow redirects itself).
+        """
+        if not is_short_link(url):
+            return url
+
+        url = url.strip()
+        if url in self._cache:
+            self._cache.move_to_end(url)
+            self.hits += 1
+            return self._cache[url]
+        self.misses += 1
+
+        current = url
+        try:
+            session = self._get_session()
+            for _ in range(self.MAX_REDIRECTS):
+                async with session.get(current, allow_redirects=False) as response:
+                    location = response.headers.get('Location')
+                if not location:
+                    break
+
+                current = urljoin(current, location)
+                route = route_url(current)
+                if route is None:
+                    break
+                if route.canonical_id:
+                    # Параметры отслеживания в query не нужны
+                    parts = urlsplit(current)
+                    canonical_url = urlunsplit((parts.scheme, parts.netloc, parts.path, '', ''))
+                    self._remember(url, canonical_url)
+                    return canonical_url
+        except Exception as e:
+            print(f"⚠️ Short link resolve failed for {url}: {e}")
+
+        return url
+
+    def _remember(self, short_url: str, canonical_url: str):
+        self._cache[short_url] = canonical_url
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def close(self):
+        """Close connection pool"""
+        if self._session and not self._session.closed:
+            await self._session.close()
+
+
+# Singleton instance
+short_link_resolver = ShortLinkResolver()
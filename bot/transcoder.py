@@ -0,0 +1,186 @@
+import asyncio
+import os
+import shutil
+import struct
+import time
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+from config import (
+    TRANSCODE_ENABLED, TRANSCODE_MAX_JOBS, TRANSCODE_THREADS, TRANSCODE_MAX_RATIO,
+    TRANSCODE_MIN_VIDEO_BITRATE, TRANSCODE_AUDIO_BITRATE, TRANSCODE_PRESET, TRANSCODE_TIMEOUT
+)
+
+
+class Transcoder:
+    """ffmpeg post-processing: bitrate-targeted transcoding and faststart remux"""
+
+    # Доля размера на контейнер mp4 и погрешность битрейта кодера
+    _SIZE_OVERHEAD = 0.05
+
+    def __init__(self):
+        self.available = shutil.which('ffmpeg') is not None
+        # Ограничивает число одновременно работающих ffmpeg
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        # Идущие перепаковки: путь -> задача; объединенные запросы делят один файл
+        self._remuxing: Dict[str, asyncio.Task] = {}
+        self.stats = {
+            'transcoded': 0,  # Успешно сжато
+            'failed': 0,  # Ошибка ffmpeg или результат не влез в лимит
+            'seconds': 0.0,  # Суммарное время перекодирования
+            'remuxed': 0,  # Индекс moov перенесен в начало файла
+        }
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(TRANSCODE_MAX_JOBS)
+        return self._semaphore
+
+    def target_video_bitrate(self, file_size: int, duration: Optional[float], max_size: int) -> Optional[int]:
+        """
+        Video bitrate (bit/s) that fits the file into max_size
+
+        Returns None when transcoding is disabled, pointless or would ruin quality.
+        """
+        if not TRANSCODE_ENABLED or not self.available or not duration:
+            return None
+        if file_size <= max_size or file_size > max_size * TRANSCODE_MAX_RATIO:
+            return None
+
+        total_bitrate = max_size * 8 * (1 - self._SIZE_OVERHEAD) / duration
+        video_bitrate = int(total_bitrate - TRANSCODE_AUDIO_BITRATE)
+        if video_bitrate < TRANSCODE_MIN_VIDEO_BITRATE:
+            return None
+        # Исходник уже жмется сильнее - перекодирование только испортит качество
+        if video_bitrate >= file_size * 8 / duration:
+            return None
+        return video_bitrate
+
+    async def _run_ffmpeg(self, args: list) -> bool:
+        """Run ffmpeg, kill it on timeout"""
+        process = await asyncio.create_subprocess_exec(
+            'ffmpeg', '-hide_banner', '-loglevel', 'error', '-y', *args,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await asyncio.wait_for(process.communicate(), TRANSCODE_TIMEOUT)
+        except asyncio.TimeoutError:
+            process.kill()
+            await process.wait()
+            print(f"⚠️ ffmpeg timed out after {TRANSCODE_TIMEOUT}s")
+            return False
+        if process.returncode != 0:
+            print(f"⚠️ ffmpeg failed: {stderr.decode(errors='replace')[-300:]}")
+            return False
+        return True
+
+    async def shrink(self, filepath: str, video_bitrate: int, max_size: int) -> Optional[str]:
+        """
+        Two-pass transcode to the given video bitrate
+
+        Returns path of the new file (next to the source) or None if it failed
+        or still does not fit max_size.
+        """
+        source = Path(filepath)
+        # Уникальные имена: параллельные вызовы для одного файла не пишут друг другу поверх
+        suffix = uuid.uuid4().hex[:8]
+        output = source.with_name(f"{source.stem}_tg_{suffix}.mp4")
+        passlog = source.with_name(f"{source.stem}_passlog_{suffix}")
+        video_args = [
+            '-c:v', 'libx264', '-preset', TRANSCODE_PRESET,
+            '-b:v', str(video_bitrate),
+            # Пики битрейта ограничены, чтобы итоговый размер был предсказуемым
+            '-maxrate', str(int(video_bitrate * 1.5)), '-bufsize', str(video_bitrate * 2),
+            '-threads', str(TRANSCODE_THREADS),
+            '-passlogfile', str(passlog),
+        ]
+
+        async with self.semaphore:
+            started_at = time.monotonic()
+            print(f"🗜️ Transcoding {source.name} to {video_bitrate // 1000} kbit/s")
+            try:
+                ok = await self._run_ffmpeg([
+                    '-i', str(source), *video_args, '-pass', '1', '-an', '-f', 'null', '/dev/null'
+                ]) and await self._run_ffmpeg([
+                    '-i', str(source), *video_args, '-pass', '2',
+                    '-c:a', 'aac', '-b:a', str(TRANSCODE_AUDIO_BITRATE),
+                    '-movflags', '+faststart', str(output)
+                ])
+            finally:
+                for log in source.parent.glob(f"{passlog.name}*"):
+                    log.unlink(missing_ok=True)
+            self.stats['seconds'] += time.monotonic() - started_at
+
+        if ok and output.exists() and output.stat().st_size <= max_size:
+            self.stats['transcoded'] += 1
+            return str(output)
+
+        self.stats['failed'] += 1
+        output.unlink(missing_ok=True)
+        return None
+
+    @staticmethod
+    def has_faststart(filepath: str) -> bool:
+        """Check that the moov atom comes before mdat (top-level boxes only)"""
+        try:
+            with open(filepath, 'rb') as f:
+                while True:
+                    header = f.read(8)
+                    if len(header) < 8:
+                        return False
+                    size, box_type = struct.unpack('>I4s', header)
+                    if box_type == b'moov':
+                        return True
+                    if box_type == b'mdat':
+                        return False
+                    if size == 1:
+                        # 64-битный размер бокса
+                        size = struct.unpack('>Q', f.read(8))[0] - 8
+                    elif size == 0:
+                        return False
+                    f.seek(size - 8, os.SEEK_CUR)
+        except (OSError, struct.error):
+            return False
+
+    async def make_faststart(self, filepath: str) -> bool:
+        """
+        Move the moov atom to the front with a stream-copy remux (no re-encode)
+
+        The file is replaced atomically, readers holding it open are not affected.
+        Concurrent calls for the same file share one remux.
+        Returns True if the file is faststart now.
+        """
+        if self.has_faststart(filepath):
+            return True
+        if not self.available:
+            return False
+
+        task = self._remuxing.get(filepath)
+        if task is None:
+            task = asyncio.ensure_future(self._remux_faststart(filepath))
+            self._remuxing[filepath] = task
+            task.add_done_callback(lambda _: self._remuxing.pop(filepath, None))
+        return await asyncio.shield(task)
+
+    async def _remux_faststart(self, filepath: str) -> bool:
+        """Remux into a uniquely named file next to the source, then replace the source"""
+        source = Path(filepath)
+        output = source.with_name(f"{source.stem}_faststart_{uuid.uuid4().hex[:8]}.mp4")
+        async with self.semaphore:
+            ok = await self._run_ffmpeg([
+                '-i', str(source), '-map', '0', '-c', 'copy', '-movflags', '+faststart', str(output)
+            ])
+        if not ok or not output.exists():
+            output.unlink(missing_ok=True)
+            return False
+
+        os.replace(output, source)
+        self.stats['remuxed'] += 1
+        return True
+
+
+# Singleton instance
+transcoder = Transcoder()
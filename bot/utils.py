@@ -1,5 +1,9 @@
-﻿import re
-from urllib.parse import urlparse
+﻿import os
+import re
+from typing import List, NamedTuple, Optional
+from urllib.parse import urlparse, urlsplit
+
+from config import ALLOWED_DOMAINS
 
 
 def format_size(size_bytes: int) -> str:
@@ -23,6 +27,15 @@ def is_valid_url(url: str) -> bool:
         return False
 
 
+# Ссылки в произвольном тексте (без завершающей пунктуации)
+_URL_IN_TEXT_RE = re.compile(r'https?://[^\s<>"\']+[^\s<>"\'.,;:!?)\]]', re.IGNORECASE)
+
+
+def extract_urls(text: str) -> List[str]:
+    """Find http(s) URLs in free text"""
+    return _URL_IN_TEXT_RE.findall(text or '')
+
+
 def extract_domain(url: str) -> str:
     """Extract domain from URL"""
     try:
@@ -50,4 +63,87 @@ def get_platform_icon(platform: str) -> str:
         'tiktok': '🎵',
         'unknown': '📹'
     }
-    return icons.get(platform, '📹')
\ No newline at end of file
+    return icons.get(platform, '📹')
+
+
+# ========== URL ROUTER ==========
+
+class UrlRoute(NamedTuple):
+    platform: str
+    canonical_id: Optional[str]  # None - id не виден в ссылке (короткие ссылки и т.п.)
+
+
+# Платформа по домену из ALLOWED_DOMAINS
+_PLATFORM_BY_DOMAIN = {
+    'instagram.com': 'instagram',
+    'youtube.com': 'youtube',
+    'youtu.be': 'youtube',
+    'tiktok.com': 'tiktok',
+    'vm.tiktok.com': 'tiktok',
+    'vt.tiktok.com': 'tiktok',
+}
+
+# Хост совпадает с разрешенным доменом или является его поддоменом
+_HOST_RE = re.compile(
+    r'^(?:[a-z0-9-]+\.)*?('
+    + '|'.join(re.escape(d) for d in sorted(ALLOWED_DOMAINS, key=len, reverse=True))
+    + r')$'
+)
+
+_YOUTUBE_PATH_RE = re.compile(r'^/(?:shorts|embed|live|v)/([\w-]{11})(?:/|$)')
+_YOUTUBE_SHORT_RE = re.compile(r'^/([\w-]{11})(?:/|$)')
+_YOUTUBE_QUERY_RE = re.compile(r'(?:^|&)v=([\w-]{11})(?:&|$)')
+# /share/... - короткая ссылка, а не имя пользователя: id появляется только после редиректа
+_INSTAGRAM_PATH_RE = re.compile(r'^/(?:(?!share/)[\w.]+/)?(?:p|reels?|tv)/([\w-]+)')
+_TIKTOK_PATH_RE = re.compile(r'^/(?:@[\w.-]+/(?:video|photo)|v|embed(?:/v2)?)/(\d+)')
+
+# Короткие ссылки, id видео в которых появляется только после редиректа
+_SHORT_LINK_HOST_RE = re.compile(r'^(?:vm|vt)\.tiktok\.com$')
+_SHORT_LINK_PATH_RE = re.compile(r'^/(?:t|share)/[\w-]+')
+
+
+def route_url(url: str) -> Optional[UrlRoute]:
+    """
+    Match URL against supported platforms without network access
+    
+    Returns UrlRoute(platform, canonical_id) or None if the host is not allowed.
+    canonical_id looks like 'youtube:dQw4w9WgXcQ' and is shared by all URL shapes of a video.
+    """
+    try:
+        parts = urlsplit(url.strip())
+        host = parts.hostname or ''
+    except ValueError:
+        return None
+    if parts.scheme not in ('http', 'https'):
+        return None
+    
+    host_match = _HOST_RE.match(host)
+    if not host_match:
+        return None
+    domain = host_match.group(1)
+    platform = _PLATFORM_BY_DOMAIN.get(domain, 'unknown')
+    
+    path = parts.path
+    match = None
+    if platform == 'youtube':
+        if domain == 'youtu.be':
+            match = _YOUTUBE_SHORT_RE.match(path)
+        else:
+            match = _YOUTUBE_PATH_RE.match(path)
+            if not match and path.rstrip('/') == '/watch':
+                match = _YOUTUBE_QUERY_RE.search(parts.query)
+    elif platform == 'instagram':
+        match = _INSTAGRAM_PATH_RE.match(path)
+    elif platform == 'tiktok':
+        match = _TIKTOK_PATH_RE.match(path)
+    
+    return UrlRoute(platform, f"{platform}:{match.group(1)}" if match else None)
+
+
+def is_short_link(url: str) -> bool:
+    """Check if URL is a redirecting short link (vm.tiktok.com, tiktok.com/t/..., instagram.com/share/...)"""
+    route = route_url(url)
+    if route is None or route.canonical_id:
+        return False
+    parts = urlsplit(url.strip())
+    return bool(_SHORT_LINK_HOST_RE.match(parts.hostname or '') or _SHORT_LINK_PATH_RE.match(parts.path))
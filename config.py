@@ -3,6 +3,10 @@ from pathlib import Path
 
 # ========== TELEGRAM BOT ==========
 TELEGRAM_TOKEN = os.getenv("TELEGRAM_TOKEN", "")
+# Собственный сервер Bot API (telegram-bot-api), например http://telegram-bot-api:8081
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "")
+# --local: файлы до 2GB, отправка по пути к файлу (каталог temp должен быть виден серверу Bot API)
+TELEGRAM_LOCAL_MODE = bool(TELEGRAM_API_URL) and os.getenv("TELEGRAM_LOCAL_MODE", "0") == "1"
 
 # ========== ADMIN SETTINGS ==========
 ADMIN_IDS = []  # Çàìåíèòå íà âàø Telegram ID
@@ -16,14 +20,87 @@ FILE_SERVER_URL = os.getenv("FILE_SERVER_URL", f"http://localhost:{FILE_SERVER_P
 BASE_DIR = Path(__file__).parent
 TEMP_DIR = BASE_DIR / "temp"
 VIDEOS_DIR = TEMP_DIR / "videos"
+INCOMING_DIR = VIDEOS_DIR / ".incoming"  # Крупные видео качаются сразу в хранилище (та же ФС, без копирования)
 TEMP_DOWNLOADS_DIR = TEMP_DIR / "downloads"
 LINKS_DB = TEMP_DIR / "links.json"
+FILE_ID_CACHE_DB = TEMP_DIR / "file_ids.json"
+FORMAT_STATS_DB = TEMP_DIR / "format_stats.json"
+METADATA_CACHE_DIR = TEMP_DIR / "metadata"
 
 # ========== DEFAULT SETTINGS ==========
 DEFAULT_MAX_SERVER_SIZE = 500 * 1024 * 1024  # 500MB - ìàêñèìàëüíûé ðàçìåð äëÿ ñåðâåðà
-DEFAULT_MAX_CHAT_SIZE = 50 * 1024 * 1024  # 50MB - ìàêñèìàëüíûé ðàçìåð äëÿ îòïðàâêè â ÷àò
+DEFAULT_MAX_CHAT_SIZE = (2000 if TELEGRAM_LOCAL_MODE else 50) * 1024 * 1024  # 2000MB / 50MB - ìàêñèìàëüíûé ðàçìåð äëÿ îòïðàâêè â ÷àò
 DEFAULT_LINK_EXPIRE_MINUTES = 60  # 1 ÷àñ
 
+# ========== TELEGRAM FILE_ID CACHE ==========
+FILE_ID_CACHE_TTL_HOURS = int(os.getenv("FILE_ID_CACHE_TTL_HOURS", "720"))  # 30 дней
+FILE_ID_CACHE_MAX_ENTRIES = int(os.getenv("FILE_ID_CACHE_MAX_ENTRIES", "5000"))
+
+# ========== FAIR SCHEDULING ==========
+USER_MAX_INFLIGHT = int(os.getenv("USER_MAX_INFLIGHT", "3"))  # Ссылок одного пользователя в обработке
+USER_RATE_PER_MINUTE = float(os.getenv("USER_RATE_PER_MINUTE", "10"))  # Ссылок в минуту в среднем
+USER_RATE_BURST = int(os.getenv("USER_RATE_BURST", "10"))  # Ссылок подряд без ожидания
+ADMIN_SCHEDULER_WEIGHT = 2  # Доля слотов загрузки администратора относительно обычного пользователя
+
+# ========== BATCH MODE ==========
+BATCH_MAX_URLS = int(os.getenv("BATCH_MAX_URLS", "10"))  # Ссылок из одного сообщения
+
+# ========== DOWNLOAD QUEUE ==========
+DOWNLOAD_WORKERS = int(os.getenv("DOWNLOAD_WORKERS", "4"))  # Всего одновременных загрузок
+DOWNLOAD_QUEUE_SIZE = int(os.getenv("DOWNLOAD_QUEUE_SIZE", "50"))  # Максимум ожидающих задач
+PLATFORM_DOWNLOAD_LIMITS = {  # Одновременных загрузок на платформу
+    'youtube': 2,
+    'instagram': 2,
+    'tiktok': 2,
+    'unknown': 1,
+}
+PROGRESS_UPDATE_INTERVAL = 3  # Секунд между обновлениями прогресса в чате
+PLAYLIST_DOWNLOAD_CONCURRENCY = 3  # Одновременно скачиваемых видео одного поста (карусель Instagram)
+PARTIAL_DOWNLOAD_MAX_AGE_HOURS = int(os.getenv("PARTIAL_DOWNLOAD_MAX_AGE_HOURS", "24"))  # Хранение недокачанных файлов
+# 'thread' - yt-dlp в потоках бота; 'process' - в отдельных процессах (не конкурирует с ботом за GIL)
+DOWNLOAD_ENGINE = os.getenv("DOWNLOAD_ENGINE", "thread")
+
+# ========== DIRECT URL DELIVERY ==========
+# Небольшие mp4 Telegram скачивает сам по ссылке CDN - без загрузки через наш сервер
+DIRECT_URL_DELIVERY = os.getenv("DIRECT_URL_DELIVERY", "1") == "1"
+DIRECT_URL_MAX_SIZE = 20 * 1024 * 1024  # Лимит Telegram на отправку видео по URL
+
+# ========== RAM STAGING ==========
+# Небольшие видео качаются в tmpfs (память) вместо диска
+RAM_STAGING_DIR = Path(os.getenv("RAM_STAGING_DIR", "/dev/shm/yisaver"))
+RAM_STAGING_MAX_FILE_SIZE = 20 * 1024 * 1024  # Видео крупнее качаются на диск
+# Всего в памяти; 0 - выключено. В локальном режиме Bot API файлы должны быть видны его серверу, а не в /dev/shm
+RAM_STAGING_BUDGET = int(os.getenv("RAM_STAGING_BUDGET_MB", "0" if TELEGRAM_LOCAL_MODE else "256")) * 1024 * 1024
+
+# ========== FRAGMENT DOWNLOADS ==========
+# Параллельная загрузка фрагментов HLS/DASH и размер HTTP-чанков по платформам
+FRAGMENT_DOWNLOAD_SETTINGS = {
+    'youtube': {'concurrent_fragments': 4, 'http_chunk_size': 10 * 1024 * 1024},
+    'tiktok': {'concurrent_fragments': 4, 'http_chunk_size': None},
+    'instagram': {'concurrent_fragments': 2, 'http_chunk_size': None},
+    'unknown': {'concurrent_fragments': 1, 'http_chunk_size': None},
+}
+
+# ========== METADATA CACHE ==========
+METADATA_CACHE_TTL = int(os.getenv("METADATA_CACHE_TTL", "1800"))  # Секунд; не дольше срока подписанных ссылок
+METADATA_CACHE_MAX_ENTRIES = int(os.getenv("METADATA_CACHE_MAX_ENTRIES", "256"))
+METADATA_CACHE_DISK = os.getenv("METADATA_CACHE_DISK", "1") == "1"  # Дублировать кэш на диск
+
+# ========== TRANSCODING ==========
+# Сжатие видео чуть больше лимита чата (ffmpeg, двухпроходное кодирование с целевым битрейтом)
+TRANSCODE_ENABLED = os.getenv("TRANSCODE_ENABLED", "1") == "1"
+TRANSCODE_MAX_JOBS = int(os.getenv("TRANSCODE_MAX_JOBS", "1"))  # Одновременных перекодирований
+TRANSCODE_THREADS = int(os.getenv("TRANSCODE_THREADS", "2"))  # Потоков ffmpeg на задачу (бюджет CPU)
+TRANSCODE_MAX_RATIO = 2.0  # Сжимаем только видео не больше лимита × N
+TRANSCODE_MIN_VIDEO_BITRATE = 400 * 1000  # бит/с - ниже качество неприемлемо
+TRANSCODE_AUDIO_BITRATE = 128 * 1000  # бит/с
+TRANSCODE_PRESET = os.getenv("TRANSCODE_PRESET", "veryfast")
+TRANSCODE_TIMEOUT = 900  # Секунд на одно перекодирование
+
+# ========== SHORT LINKS ==========
+SHORT_LINK_CACHE_SIZE = int(os.getenv("SHORT_LINK_CACHE_SIZE", "2048"))  # Запомненных редиректов
+SHORT_LINK_TIMEOUT = int(os.getenv("SHORT_LINK_TIMEOUT", "10"))  # Секунд на разрешение ссылки
+
 # ========== ALLOWED DOMAINS ==========
 ALLOWED_DOMAINS = [
     "instagram.com",
@@ -35,10 +112,17 @@ ALLOWED_DOMAINS = [
 ]
 
 # ========== CREATE DIRECTORIES ==========
-TEMP_DIR.mkdir(exist_ok=True)
-VIDEOS_DIR.mkdir(exist_ok=True)
-TEMP_DOWNLOADS_DIR.mkdir(exist_ok=True)
+def create_directories():
+    """Create working directories (called once at startup, not on import)"""
+    TEMP_DIR.mkdir(exist_ok=True)
+    VIDEOS_DIR.mkdir(exist_ok=True)
+    INCOMING_DIR.mkdir(exist_ok=True)
+    TEMP_DOWNLOADS_DIR.mkdir(exist_ok=True)
+    METADATA_CACHE_DIR.mkdir(exist_ok=True)
 
 # ========== COOKIES SETTINGS ==========
 USE_BROWSER_COOKIES = True  # Àâòîìàòè÷åñêè èñïîëüçîâàòü cookies èç áðàóçåðà
 COOKIES_FILE = None  # Èëè ïóòü ê ôàéëó cookies.txt
+COOKIES_DIR = Path(os.getenv("COOKIES_DIR")) if os.getenv("COOKIES_DIR") else None  # Каталог с Netscape cookies: youtube.txt, instagram.txt, tiktok.txt или cookies.txt
+COOKIES_CACHE_DIR = TEMP_DIR / "cookies"  # Cookies, выгруженные из браузера
+BROWSER_COOKIES_RETRY_MINUTES = 30  # Повтор поиска cookies в браузерах после неудачи
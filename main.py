@@ -1,12 +1,25 @@
-﻿import asyncio
+﻿import time
+
+# Момент запуска процесса - для отчета о времени старта
+START_TIME = time.perf_counter()
+
+import asyncio
 import threading
+import urllib.request
 from multiprocessing import Process
 
-from telegram.ext import Application
+from telegram import Update
+from telegram.ext import Application, TypeHandler
 
-from config import TELEGRAM_TOKEN, FILE_SERVER_HOST, FILE_SERVER_PORT
+from config import TELEGRAM_TOKEN, TELEGRAM_API_URL, TELEGRAM_LOCAL_MODE, FILE_SERVER_HOST, FILE_SERVER_PORT, FILE_SERVER_URL, create_directories
 from bot.handlers import setup_handlers
 from bot.file_server import file_server
+from bot.file_id_cache import file_id_cache
+from bot.format_stats import format_stats
+from bot.short_links import short_link_resolver
+
+# Сколько ждать готовности файлового сервера
+FILE_SERVER_READY_TIMEOUT = 10
 
 
 def run_file_server():
@@ -20,25 +33,76 @@ def run_file_server():
     )
 
 
+def wait_for_file_server(timeout: float = FILE_SERVER_READY_TIMEOUT) -> bool:
+    """Poll /readyz until the file server answers 200 or timeout expires"""
+    host = '127.0.0.1' if FILE_SERVER_HOST in ('0.0.0.0', '') else FILE_SERVER_HOST
+    ready_url = f"http://{host}:{FILE_SERVER_PORT}/readyz"
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with urllib.request.urlopen(ready_url, timeout=1) as response:
+                if response.status == 200:
+                    return True
+        except OSError:
+            pass
+        time.sleep(0.05)
+    return False
+
+
+def build_application() -> Application:
+    """Application for the public Bot API or a self-hosted server (TELEGRAM_API_URL)"""
+    builder = Application.builder().token(TELEGRAM_TOKEN)
+    if TELEGRAM_API_URL:
+        # Собственный сервер Bot API
+        api_url = TELEGRAM_API_URL.rstrip('/')
+        builder = builder.base_url(f"{api_url}/bot").base_file_url(f"{api_url}/file/bot")
+        builder = builder.local_mode(TELEGRAM_LOCAL_MODE)
+        print(f"🛰️ Bot API server: {api_url} (local mode: {'on' if TELEGRAM_LOCAL_MODE else 'off'})")
+    return builder.build()
+
+
 async def run_bot():
     """Run Telegram bot"""
     # Create Application
-    application = Application.builder().token(TELEGRAM_TOKEN).build()
+    application = build_application()
     
     # Setup handlers
     setup_handlers(application)
     
+    # Время до первого обновления от Telegram
+    first_update_seen = False
+    
+    async def report_first_update(update: Update, context):
+        nonlocal first_update_seen
+        if not first_update_seen:
+            first_update_seen = True
+            print(f"⏱️ Первое обновление через {time.perf_counter() - START_TIME:.2f} с после запуска")
+    
+    application.add_handler(TypeHandler(Update, report_first_update), group=-1)
+    
     # Start bot
     print("🤖 Telegram bot is starting...")
     print(f"🌐 File server URL: http://{FILE_SERVER_HOST}:{FILE_SERVER_PORT}")
     print(f"📁 Videos directory: temp/videos/")
     
+    startup_time = time.perf_counter() - START_TIME
+    
     await application.initialize()
     await application.start()
     await application.updater.start_polling()
     
+    print(f"⏱️ Холодный старт: {startup_time:.2f} с (без подключения к Telegram), "
+          f"с подключением: {time.perf_counter() - START_TIME:.2f} с")
+    
     # Keep running
-    await asyncio.Event().wait()
+    try:
+        await asyncio.Event().wait()
+    finally:
+        # Несохраненные счетчики кэша file_id и статистика форматов
+        file_id_cache.flush()
+        format_stats.flush()
+        # Пул соединений для раскрытия коротких ссылок
+        await short_link_resolver.close()
 
 
 def main():
@@ -50,6 +114,8 @@ def main():
     # Add current directory to path
     sys.path.append(os.path.dirname(os.path.abspath(__file__)))
     
+    create_directories()
+    
     try:
         # Запускаем файловый сервер в отдельном потоке
         from bot.file_server import file_server
@@ -69,11 +135,11 @@ def main():
         server_thread = Thread(target=run_server, daemon=True)
         server_thread.start()
         
-        # Ждем немного для запуска сервера
-        import time
-        time.sleep(2)
-        
-        print(f"✅ Файловый сервер запущен: {FILE_SERVER_URL}")
+        # Ждем, пока сервер ответит на /readyz
+        if wait_for_file_server():
+            print(f"✅ Файловый сервер запущен: {FILE_SERVER_URL}")
+        else:
+            print(f"⚠️ Файловый сервер не ответил за {FILE_SERVER_READY_TIMEOUT} с: {FILE_SERVER_URL}")
         
     except Exception as e:
         print(f"⚠️ Не удалось запустить файловый сервер: {e}")